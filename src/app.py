@@ -22,7 +22,7 @@ st.set_page_config(page_title="StudyMate", page_icon=icon_path, layout="wide")
 # --- Initialize Backend ---
 @st.cache_resource
 def get_backend():
-    vdb = vectordb(db_path=DB_PATH, persist_dir=CHROMA_DIR)
+    vdb = vectordb(db_path=DB_PATH, persist_dir=CHROMA_DIR, upload_dir=UPLOAD_DIR)
     assistant = RAGAssistant(vdb)
     return vdb, assistant
 
@@ -42,6 +42,10 @@ if "view_mode" not in st.session_state:
 if "uploader_key" not in st.session_state:
     st.session_state.uploader_key = 0
 
+# Chat scope: doc_ids and an optional 0-based (first, last) page range; empty = whole session
+if "chat_scope" not in st.session_state:
+    st.session_state.chat_scope = {"doc_ids": [], "pages": None}
+
 def refresh_messages():
     if st.session_state.active_session:
         session_id = db.get_session_id(st.session_state.active_session)
@@ -104,8 +108,7 @@ with st.sidebar:
     if selected_session != st.session_state.active_session:
         st.session_state.active_session = selected_session
         st.session_state.view_mode = "ingest"
-        session_id = db.get_session_id(selected_session)
-        st.session_state.current_docs = db.get_documents(session_id)
+        st.session_state.chat_scope = {"doc_ids": [], "pages": None}
         refresh_messages()
         st.rerun()
 
@@ -161,8 +164,7 @@ with st.sidebar:
                     st.success(f"Session '{new_session_name}' created under '{subject_category}'!")
                     st.session_state.active_session = new_session_name
                     st.session_state.view_mode = "ingest"
-                    session_id = db.get_session_id(new_session_name)
-                    st.session_state.current_docs = db.get_documents(session_id)
+                    st.session_state.chat_scope = {"doc_ids": [], "pages": None}
                     refresh_messages()
                     st.rerun()
                 else:
@@ -252,22 +254,13 @@ else:
         if st.button("Add to Session"):
             if uploaded_files:
                 with st.status("Processing PDFs..."):
-                    saved_paths = []
-                    for uploaded_file in uploaded_files:
-                        file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        saved_paths.append(file_path)
-                    vdb.add_file(saved_paths, st.session_state.active_session)
-                    st.success(f"{len(saved_paths)} document(s) added successfully!")
+                    # Ingested straight from memory; vdb stores the bytes content-addressed.
+                    vdb.add_file(uploaded_files, st.session_state.active_session)
+                    st.success(f"{len(uploaded_files)} document(s) added successfully!")
                 
                 # --- Reset Uploader via Dynamic Key ---
                 st.session_state.uploader_key += 1
                 
-                # --- Refresh current documents list ---
-                session_id = db.get_session_id(st.session_state.active_session)
-                st.session_state.current_docs = db.get_documents(session_id)
-                
                 st.rerun()
             else:
                 st.warning("No files selected.")
@@ -288,18 +281,44 @@ else:
         </h2>
         """, unsafe_allow_html=True)
     
-        # --- Display current documents using session_state ---
-        if "current_docs" not in st.session_state:
-            session_id = db.get_session_id(st.session_state.active_session)
-            st.session_state.current_docs = db.get_documents(session_id)
-    
-        docs = st.session_state.current_docs
+        # --- Display current documents ---
+        # Served from the Database read cache; only re-queried after a write.
+        session_id = db.get_session_id(st.session_state.active_session)
+        docs = db.get_documents(session_id)
         if docs:
             for doc in docs:
                 st.text(f"📄 {doc[2]}")
         else:
             st.write("No documents in this session yet.")
 
+        # --- Chat scope: limit retrieval to selected documents / pages ---
+        if docs:
+            st.divider()
+            st.markdown("**Chat scope**")
+            doc_names = {doc[0]: doc[2] for doc in docs}
+            page_counts = db.get_page_counts(session_id)
+            scope = st.session_state.chat_scope
+            selected_docs = st.multiselect(
+                "Only answer from these documents (leave empty for all)",
+                options=list(doc_names),
+                default=[d for d in scope["doc_ids"] if d in doc_names],
+                format_func=lambda d: doc_names[d]
+            )
+            pages = None
+            if selected_docs and st.checkbox("Limit to a page range", value=scope["pages"] is not None):
+                max_page = max(page_counts.get(d, 0) for d in selected_docs) or 1
+                col_from, col_to = st.columns(2)
+                first_page = col_from.number_input(
+                    "From page", min_value=1, max_value=max_page,
+                    value=(scope["pages"][0] + 1) if scope["pages"] else 1
+                )
+                last_page = col_to.number_input(
+                    "To page", min_value=1, max_value=max_page,
+                    value=min((scope["pages"][1] + 1) if scope["pages"] else max_page, max_page)
+                )
+                pages = (int(first_page) - 1, int(last_page) - 1)  # stored 0-based, like the loaders
+            st.session_state.chat_scope = {"doc_ids": selected_docs, "pages": pages}
+
 
     # --- Ingest View ---
 #    if st.session_state.view_mode == "ingest":
@@ -389,6 +408,13 @@ else:
         </h1>
         """, unsafe_allow_html=True)
 
+        scope = st.session_state.chat_scope
+        if scope["doc_ids"]:
+            scoped_names = [doc[2] for doc in db.get_documents(db.get_session_id(st.session_state.active_session))
+                            if doc[0] in scope["doc_ids"]]
+            page_note = f", pages {scope['pages'][0] + 1}-{scope['pages'][1] + 1}" if scope["pages"] else ""
+            st.caption(f"🔎 Scoped to: {', '.join(scoped_names)}{page_note}")
+
         chat_container = st.container()
         
         with chat_container:
@@ -408,7 +434,10 @@ else:
                 message_placeholder = st.empty()
                 full_response = ""
                 with st.spinner("Thinking..."):
-                    for chunk in assistant.query(st.session_state.active_session, prompt):
+                    for chunk in assistant.query(
+                        st.session_state.active_session, prompt,
+                        doc_ids=scope["doc_ids"], pages=scope["pages"]
+                    ):
                         full_response += chunk
                         message_placeholder.markdown(full_response + "▌")
                     message_placeholder.markdown(full_response)
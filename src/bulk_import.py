@@ -0,0 +1,394 @@
+"""
+Headless bulk importer for whole course libraries.
+
+Walks one or more directory trees, maps folders to sessions (and optionally
+subject categories), and ingests the PDFs across a pool of worker processes.
+Each worker loads the embedding model once and does the expensive part
+(PDF parsing, semantic chunking, embedding); the parent process is the only
+writer to Chroma and SQLite. Workers read the near-duplicate index before
+embedding and skip chunks it already covers; the parent re-checks what they
+embedded against chunks stored since, then records the skipped ones.
+
+Progress is recorded per file in the `import_manifest` table, so re-running
+the same command after an interruption skips files that already finished.
+A file that was being stored when the import stopped is removed (document
+row, page text and vectors) before it is imported again.
+
+Layouts:
+    --layout session   ROOT/<session_name>/**/*.pdf
+    --layout category  ROOT/<subject_category>/<session_name>/**/*.pdf
+
+PDFs placed directly under ROOT go to a session named after ROOT itself.
+
+Example:
+    python src/bulk_import.py ~/courses/fall --category Physics --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import time
+import uuid
+
+from langchain_chroma import Chroma
+
+from classes import (
+    Database,
+    build_text_splitter,
+    collection_metadata,
+    hnsw_params,
+    load_embedding_engine,
+    load_pdf,
+    maybe_retune,
+    page_rows,
+    purge_document,
+    tag_chunks
+)
+from dedup import ChunkDeduplicator
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHROMA_DIR = os.path.join(PROJECT_ROOT, "chroma_db")
+DB_PATH = os.path.join(PROJECT_ROOT, "studymate.db")
+
+
+# ------------------- Directory walking -------------------
+
+def _session_name(folder_name):
+    # Session names double as Chroma collection names: 3-63 characters of
+    # [A-Za-z0-9_-], starting and ending alphanumeric (the app also rejects spaces).
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", folder_name.strip()).strip("_-")
+    name = name[:63].rstrip("_-")
+    if len(name) < 3:
+        name = f"{name}_session" if name else "session"
+    return name
+
+
+def _find_pdfs(folder):
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".pdf"):
+                yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def discover(roots, layout, default_category):
+    """
+    Returns a list of (file_path, session_name, subject_category, folder) tuples.
+    Folders whose names map to the same session name are reported and left out
+    rather than merged into one session.
+    """
+    tasks = []
+    for root in roots:
+        root = os.path.abspath(root)
+        top_files = [
+            os.path.join(root, f) for f in sorted(os.listdir(root))
+            if f.lower().endswith(".pdf") and os.path.isfile(os.path.join(root, f))
+        ]
+        for path in top_files:
+            tasks.append((path, _session_name(os.path.basename(root)), default_category, root))
+
+        for entry in sorted(os.listdir(root)):
+            entry_path = os.path.join(root, entry)
+            if not os.path.isdir(entry_path):
+                continue
+            if layout == "category":
+                for session_dir in sorted(os.listdir(entry_path)):
+                    session_path = os.path.join(entry_path, session_dir)
+                    if os.path.isdir(session_path):
+                        for path in _find_pdfs(session_path):
+                            tasks.append((path, _session_name(session_dir), entry, session_path))
+            else:
+                for path in _find_pdfs(entry_path):
+                    tasks.append((path, _session_name(entry), default_category, entry_path))
+
+    folders = {}
+    for _, session_name, _, folder in tasks:
+        folders.setdefault(session_name, set()).add(folder)
+    collisions = {name: sorted(paths) for name, paths in folders.items() if len(paths) > 1}
+    for name, paths in collisions.items():
+        print(f"[ERROR] {len(paths)} folders map to session '{name}' and were skipped; rename all but one: "
+              + ", ".join(f"'{p}'" for p in paths))
+    return [task for task in tasks if task[1] not in collisions]
+
+
+# ------------------- Worker process -------------------
+
+_worker_embeddings = None
+_worker_splitter = None
+_worker_dedup = None
+
+
+def _init_worker(model_name, db_path):
+    # One embedding model per process (or a shared server), reused for every file it handles.
+    global _worker_embeddings, _worker_splitter, _worker_dedup
+    _worker_embeddings = load_embedding_engine(model_name)
+    _worker_splitter = build_text_splitter(_worker_embeddings)
+    # Read-only use: workers look up the near-duplicate index, the parent writes it.
+    _worker_dedup = ChunkDeduplicator(Database(db_path=db_path))
+
+
+def _process_file(task):
+    file_path, collection_name = task
+    started = time.perf_counter()
+    try:
+        document, _, _ = load_pdf(file_path)
+        chunks = _worker_splitter.split_documents(document)
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        unique, signatures, duplicates = _worker_dedup.split(collection_name, chunks, ids) if chunks else ([], [], [])
+        embeddings = _worker_embeddings.embed_documents([chunks[i].page_content for i in unique]) if unique else []
+        # Duplicates are sent back by position; the parent tags and links them.
+        positions = {id(chunk): i for i, chunk in enumerate(chunks)}
+        return {
+            "file_path": file_path,
+            "ok": True,
+            "pages": len(document),
+            "page_rows": page_rows(document),
+            "chunks": chunks,
+            "ids": ids,
+            "unique": unique,
+            "signatures": signatures,
+            "duplicates": [(vector_id, positions[id(chunk)]) for vector_id, chunk in duplicates],
+            "embeddings": embeddings,
+            "seconds": time.perf_counter() - started,
+        }
+    except Exception as e:
+        return {
+            "file_path": file_path,
+            "ok": False,
+            "error": f"{type(e).__name__}: {e}",
+            "seconds": time.perf_counter() - started,
+        }
+
+
+# ------------------- Parent process -------------------
+
+class BulkImporter:
+    def __init__(self, db_path=DB_PATH, persist_dir=CHROMA_DIR, workers=None):
+        self.db_path = db_path
+        self.database = Database(db_path=db_path)
+        self.persist_directory = persist_dir
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.embedding_model_name = os.environ.get("EMBEDDING_MODEL")
+        self.dedup = ChunkDeduplicator(self.database)
+        self._collections = {}
+        self._session_errors = {}  # session_name -> (session_id, error), so each is reported once
+
+    def _ensure_session(self, session_name, subject_category, folder):
+        """
+        Returns (session_id, error). On error the session's files are skipped;
+        session_id is None if the session could not be created.
+        """
+        if session_name in self._session_errors:
+            return self._session_errors[session_name]
+        session_id = self.database.get_session_id(session_name)
+        renamed = session_name != os.path.basename(folder)
+        if (session_id is not None and renamed and session_name not in self._collections
+                and not self.database.manifest_has_folder(session_id, folder)):
+            # The folder only matches an existing session after sanitising; don't merge into it.
+            error = f"folder '{folder}' maps to existing session '{session_name}'"
+            print(f"[ERROR] {error}; rename the folder to import it.")
+            self._session_errors[session_name] = (None, error)
+            return self._session_errors[session_name]
+        if session_id is None:
+            hnsw = hnsw_params(0)
+            try:
+                # Create the collection first, so a rejected name leaves no session row behind.
+                self._collections[session_name] = Chroma(
+                    collection_name=session_name,
+                    persist_directory=self.persist_directory,
+                    collection_metadata=collection_metadata(self.embedding_model_name, hnsw)
+                )
+            except Exception as e:
+                print(f"[ERROR] Cannot create session '{session_name}': {e}")
+                self._session_errors[session_name] = (None, f"{type(e).__name__}: {e}")
+                return self._session_errors[session_name]
+            session_id = self.database.add_session(session_name, subject_category)
+            self.database.set_session_collection(session_id, session_name, self.embedding_model_name,
+                                                 hnsw_params=hnsw)
+            print(f"[INFO] Created session '{session_name}' ({subject_category}).")
+        if session_name not in self._collections:
+            collection_name, model_name = self.database.get_session_collection(session_name)
+            if model_name and model_name != self.embedding_model_name:
+                # Mixing models in one collection would silently break retrieval.
+                self._collections[session_name] = None
+                print(f"[WARN] Session '{session_name}' uses '{model_name}', not '{self.embedding_model_name}'; "
+                      f"its files will be skipped. Re-index it first.")
+            else:
+                # Embeddings are computed by the workers, so the parent never loads the model.
+                hnsw, _ = self.database.get_session_hnsw(session_name)
+                try:
+                    self._collections[session_name] = Chroma(
+                        collection_name=collection_name,
+                        persist_directory=self.persist_directory,
+                        collection_metadata=collection_metadata(self.embedding_model_name, hnsw)
+                    )
+                except Exception as e:
+                    print(f"[ERROR] Cannot open the collection of '{session_name}': {e}")
+                    self._session_errors[session_name] = (session_id, f"{type(e).__name__}: {e}")
+                    return self._session_errors[session_name]
+        if self._collections[session_name] is None:
+            return session_id, "embedding model mismatch"
+        return session_id, None
+
+    def _pending(self, tasks, retry_failed, force):
+        pending = []
+        skipped = 0
+        for file_path, session_name, subject_category, folder in tasks:
+            stat = os.stat(file_path)
+            entry = self.database.get_manifest_entry(file_path)
+            if entry and not force:
+                _, _, size, mtime, status, _, _, _ = entry
+                unchanged = size == stat.st_size and mtime == stat.st_mtime
+                if unchanged and (status == "done" or (status == "failed" and not retry_failed)):
+                    skipped += 1
+                    continue
+            pending.append((file_path, session_name, subject_category, folder, stat.st_size, stat.st_mtime))
+        return pending, skipped
+
+    def _store(self, result, session_name, session_id):
+        """Stores one worker result. Returns the number of chunks skipped as near-duplicates."""
+        file_path = result["file_path"]
+        collection = self._collections[session_name]
+        collection_name = collection._collection.name
+        doc_id = self.database.add_document(session_id, os.path.basename(file_path), file_path,
+                                            pages=result["page_rows"])
+        # Recorded before anything else is stored, so an interrupted run can be cleaned up on resume.
+        self.database.set_manifest_doc(file_path, doc_id)
+        ids = []
+        try:
+            chunks = tag_chunks(result["chunks"], doc_id)
+
+            # Another worker may have stored the same content after this one checked.
+            unique = result["unique"]
+            signatures, matches = self.dedup.find_duplicates(
+                collection_name, [chunks[i] for i in unique], [result["ids"][i] for i in unique],
+                result["signatures"]
+            )
+            # Chunks dropped here may be the targets of the worker's in-file links; relink to their match.
+            replaced = {result["ids"][i]: match for i, match in zip(unique, matches) if match is not None}
+            duplicates = [(replaced.get(vector_id, vector_id), chunks[i]) for vector_id, i in result["duplicates"]]
+            duplicates.extend((match, chunks[i]) for i, match in zip(unique, matches) if match is not None)
+
+            keep = [j for j, match in enumerate(matches) if match is None]
+            stored = [unique[j] for j in keep]
+            embeddings = [result["embeddings"][j] for j in keep]
+            signatures = [signatures[j] for j in keep]
+            ids = [result["ids"][i] for i in stored]
+
+            if stored:
+                collection._collection.add(
+                    ids=ids,
+                    embeddings=embeddings,
+                    documents=[chunks[i].page_content for i in stored],
+                    metadatas=[chunks[i].metadata for i in stored]
+                )
+            self.dedup.register(collection_name, ids, signatures)
+            self.dedup.link(collection_name, duplicates)
+        except Exception:
+            # Also drop vectors already added, or they would surface in unscoped retrieval.
+            purge_document(self.database, collection, doc_id, vector_ids=ids)
+            self.database.set_manifest_doc(file_path, None)
+            raise
+        return len(duplicates)
+
+    def _clean_interrupted(self, file_path, session_name):
+        # A "pending" entry with a doc_id was stopped mid-store (Ctrl-C, kill).
+        entry = self.database.get_manifest_entry(file_path)
+        if not entry or entry[4] != "pending" or entry[7] is None:
+            return
+        purge_document(self.database, self._collections[session_name], entry[7])
+        self.database.set_manifest_doc(file_path, None)
+        print(f"[INFO] Removed the partial import of '{file_path}' (doc_id {entry[7]}).")
+
+    def run(self, tasks, retry_failed=False, force=False):
+        pending, skipped = self._pending(tasks, retry_failed, force)
+        print(f"[INFO] {len(tasks)} file(s) found, {skipped} already imported, {len(pending)} to process.")
+        if not pending:
+            return
+
+        by_path = {}
+        for file_path, session_name, subject_category, folder, size, mtime in pending:
+            session_id, error = self._ensure_session(session_name, subject_category, folder)
+            if error:
+                self.database.set_manifest_status(file_path, session_id, size, mtime, "failed", error=error)
+                continue
+            self._clean_interrupted(file_path, session_name)
+            by_path[file_path] = (session_name, session_id, size, mtime)
+            self.database.set_manifest_status(file_path, session_id, size, mtime, "pending")
+
+        if not by_path:
+            return
+
+        done = failed = pages = chunks = skipped_chunks = 0
+        total_bytes = 0
+        started = time.perf_counter()
+
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(
+            processes=min(self.workers, len(by_path)),
+            initializer=_init_worker,
+            initargs=(self.embedding_model_name, self.db_path)
+        ) as pool:
+            work = [(file_path, self._collections[entry[0]]._collection.name) for file_path, entry in by_path.items()]
+            for result in pool.imap_unordered(_process_file, work):
+                file_path = result["file_path"]
+                session_name, session_id, size, mtime = by_path[file_path]
+                if result["ok"]:
+                    try:
+                        skipped_chunks += self._store(result, session_name, session_id)
+                    except Exception as e:
+                        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+                if result["ok"]:
+                    n_chunks = len(result["chunks"])
+                    self.database.set_manifest_status(file_path, session_id, size, mtime, "done", chunks=n_chunks)
+                    done += 1
+                    pages += result["pages"]
+                    chunks += n_chunks
+                    total_bytes += size
+                    print(f"[INFO] ({done + failed}/{len(by_path)}) '{file_path}' -> '{session_name}': "
+                          f"{result['pages']} pages, {n_chunks} chunks in {result['seconds']:.1f}s")
+                else:
+                    self.database.set_manifest_status(file_path, session_id, size, mtime, "failed", error=result["error"])
+                    failed += 1
+                    print(f"[ERROR] ({done + failed}/{len(by_path)}) '{file_path}': {result['error']}")
+
+        # Imports usually grow sessions past their HNSW tier in one go; re-tune once at the end.
+        for session_name, collection in self._collections.items():
+            if collection is not None:
+                try:
+                    maybe_retune(self.database, self.persist_directory, session_name)
+                except Exception as e:
+                    print(f"[ERROR] Failed to re-tune index for '{session_name}': {e}")
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print("---- Import summary ----")
+        print(f"Files:     {done} imported, {failed} failed, {skipped} skipped")
+        print(f"Elapsed:   {elapsed:.1f}s with {min(self.workers, len(by_path))} worker(s)")
+        print(f"Throughput: {done / elapsed * 60:.1f} files/min, {pages / elapsed:.1f} pages/s, "
+              f"{chunks / elapsed:.1f} chunks/s, {total_bytes / elapsed / 1e6:.2f} MB/s")
+        print(f"Near-duplicates: {skipped_chunks}/{chunks} chunks skipped "
+              f"({skipped_chunks / chunks * 100 if chunks else 0:.1f}%)")
+        print("------------------------")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import PDF folders into StudyMate sessions.")
+    parser.add_argument("roots", nargs="+", help="Directories to import.")
+    parser.add_argument("--layout", choices=["session", "category"], default="session",
+                        help="How folders map to sessions (see module docstring).")
+    parser.add_argument("--category", default="General",
+                        help="Subject category for new sessions when the layout has none.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPUs - 1).")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path.")
+    parser.add_argument("--chroma", default=CHROMA_DIR, help="Chroma persistence directory.")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files that failed previously.")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and import everything again.")
+    args = parser.parse_args()
+
+    tasks = discover(args.roots, args.layout, args.category)
+    importer = BulkImporter(db_path=args.db, persist_dir=args.chroma, workers=args.workers)
+    importer.run(tasks, retry_failed=args.retry_failed, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,21 @@ from langchain_core.prompts import (
 )
 import os
 import sqlite3
-import sqlite3
+import threading
+import time
+import uuid
 from datetime import datetime
 import io
+import json
+import hashlib
+import tempfile
 from pypdf import PdfReader
 from langchain_core.documents import Document
 from langchain_experimental.text_splitter import SemanticChunker
+from embedding_server import connect_remote_embeddings
+from dedup import ChunkDeduplicator
+import numpy as np
+from collections import OrderedDict
 
 
 load_dotenv()
@@ -28,8 +37,46 @@ class Database:
     def __init__(self, db_path="studymate.db"):
         self.conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        # Process-wide read model: Streamlit reruns the script on every interaction,
+        # so hot reads are served from memory until a write bumps their table version.
+        self._lock = threading.RLock()
+        self._versions = {"sessions": 0, "documents": 0, "messages": 0, "chunk_links": 0}
+        self._read_cache = {}
+        self._data_version = None
         self._create_tables()
 
+    # ------------------- Read Cache -------------------
+
+    def _bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] += 1
+
+    def _check_external_writes(self):
+        # data_version changes only when *another* connection commits
+        # (e.g. the bulk importer), so our own writes are covered by _bump.
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_version is not None and data_version != self._data_version:
+            self._bump(*self._versions)
+        self._data_version = data_version
+
+    def _cached(self, key, tables, loader):
+        with self._lock:
+            self._check_external_writes()
+            version = tuple(self._versions[table] for table in tables)
+            hit = self._read_cache.get(key)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+            value = loader()
+            self._read_cache[key] = (version, value)
+            return value
+
+    def get_version(self, table):
+        """Current cache version of a table, for callers that keep their own caches."""
+        with self._lock:
+            self._check_external_writes()
+            return self._versions[table]
+
     def _create_tables(self):
         # Sessions table
         self.cursor.execute("""
@@ -63,8 +110,91 @@ class Database:
             FOREIGN KEY(session_id) REFERENCES sessions(session_id)
         )
         """)
+
+        # Which Chroma collection serves each session, and the model that built it.
+        # Sessions without a row predate this table: collection = session_name, model unknown.
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_collections (
+            session_id INTEGER PRIMARY KEY,
+            collection_name TEXT NOT NULL,
+            embedding_model TEXT,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(session_id) REFERENCES sessions(session_id)
+        )
+        """)
+
+        # HNSW settings the collection was built with; pinned ones are never auto-tuned
+        self._add_column_if_missing("session_collections", "hnsw_params", "TEXT")
+        self._add_column_if_missing("session_collections", "hnsw_pinned", "INTEGER NOT NULL DEFAULT 0")
+
+        # Extracted page text, so re-indexing never has to parse PDFs again
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_pages (
+            doc_id INTEGER NOT NULL,
+            page INTEGER NOT NULL,
+            text TEXT,
+            PRIMARY KEY(doc_id, page),
+            FOREIGN KEY(doc_id) REFERENCES documents(doc_id)
+        )
+        """)
+
+        # Near-duplicate chunk index (MinHash signatures + LSH band buckets), per collection
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_signatures (
+            collection_name TEXT NOT NULL,
+            vector_id TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY(collection_name, vector_id)
+        )
+        """)
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_lsh (
+            collection_name TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            vector_id TEXT NOT NULL
+        )
+        """)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_lsh_bucket ON chunk_lsh(collection_name, bucket)"
+        )
+
+        # Provenance of chunks skipped as near-duplicates of an existing vector
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_links (
+            collection_name TEXT NOT NULL,
+            vector_id TEXT NOT NULL,
+            doc_id INTEGER NOT NULL,
+            page INTEGER,
+            text_bytes INTEGER,
+            FOREIGN KEY(doc_id) REFERENCES documents(doc_id)
+        )
+        """)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_links_doc ON chunk_links(collection_name, doc_id)"
+        )
+
+        # Bulk import manifest (one row per source file, used to resume imports)
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_manifest (
+            file_path TEXT PRIMARY KEY,
+            session_id INTEGER,
+            file_size INTEGER,
+            file_mtime REAL,
+            status TEXT NOT NULL,
+            chunks INTEGER,
+            error TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """)
+        # Document row of an import in progress, so a resume can remove a half-stored copy
+        self._add_column_if_missing("import_manifest", "doc_id", "INTEGER")
         self.conn.commit()
 
+    def _add_column_if_missing(self, table, column, declaration):
+        columns = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
     # ------------------- Session Methods -------------------
 
     def add_session(self, session_name, subject_category):
@@ -73,41 +203,69 @@ class Database:
     
         created_at = datetime.now().isoformat()
     
-        self.cursor.execute(
-            "INSERT INTO sessions (session_name, subject_category, created_at) VALUES (?, ?, ?)",
-            (session_name, subject_category, created_at)
-        )
-    
-        self.conn.commit()
-        return self.cursor.lastrowid
+        with self._lock:
+            self.cursor.execute(
+                "INSERT INTO sessions (session_name, subject_category, created_at) VALUES (?, ?, ?)",
+                (session_name, subject_category, created_at)
+            )
+            self.conn.commit()
+            self._bump("sessions")
+            return self.cursor.lastrowid
 
 
     def session_exists(self, session_name):
-        self.cursor.execute(
-            "SELECT 1 FROM sessions WHERE session_name=?",
-            (session_name,)
-        )
-        return self.cursor.fetchone() is not None
+        with self._lock:
+            self.cursor.execute(
+                "SELECT 1 FROM sessions WHERE session_name=?",
+                (session_name,)
+            )
+            return self.cursor.fetchone() is not None
 
     def get_sessions(self):
-        self.cursor.execute("SELECT * FROM sessions")
-        return self.cursor.fetchall()
+        def load():
+            self.cursor.execute("SELECT * FROM sessions")
+            return self.cursor.fetchall()
+        return list(self._cached(("sessions",), ("sessions",), load))
 
     def get_session_id(self, session_name):
-        self.cursor.execute(
-            "SELECT session_id FROM sessions WHERE session_name=?",
-            (session_name,)
-        )
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        def load():
+            self.cursor.execute(
+                "SELECT session_id FROM sessions WHERE session_name=?",
+                (session_name,)
+            )
+            result = self.cursor.fetchone()
+            return result[0] if result else None
+        return self._cached(("session_id", session_name), ("sessions",), load)
+
+    def get_session(self, session_name):
+        with self._lock:
+            self.cursor.execute(
+                "SELECT * FROM sessions WHERE session_name=?",
+                (session_name,)
+            )
+            return self.cursor.fetchone()
+
+    def restore_session(self, session_name, subject_category, created_at):
+        # Like add_session, but keeps the original creation time (snapshot import).
+        if self.session_exists(session_name):
+            return None
+        with self._lock:
+            self.cursor.execute(
+                "INSERT INTO sessions (session_name, subject_category, created_at) VALUES (?, ?, ?)",
+                (session_name, subject_category, created_at)
+            )
+            self.conn.commit()
+            self._bump("sessions")
+            return self.cursor.lastrowid
 
     def get_subject_category(self, session_name):
-        self.cursor.execute(
-            "SELECT subject_category FROM sessions WHERE session_name=?",
-            (session_name,)
-        )
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        with self._lock:
+            self.cursor.execute(
+                "SELECT subject_category FROM sessions WHERE session_name=?",
+                (session_name,)
+            )
+            result = self.cursor.fetchone()
+            return result[0] if result else None
 
     def delete_session(self, session_name):
         session_id = self.get_session_id(session_name)
@@ -115,114 +273,824 @@ class Database:
         if not session_id:
             print("No session_id found!")
             return False
-        # Delete messages
-        deleted_messages = self.cursor.execute("DELETE FROM messages WHERE session_id=?", (session_id,)).rowcount
-        print("Messages deleted:", deleted_messages)
-        # Delete documents
-        deleted_docs = self.cursor.execute("DELETE FROM documents WHERE session_id=?", (session_id,)).rowcount
-        print("Documents deleted:", deleted_docs)
-        # Delete session
-        deleted_sess = self.cursor.execute("DELETE FROM sessions WHERE session_id=?", (session_id,)).rowcount
-        print("Session deleted:", deleted_sess)
-        self.conn.commit()
+        with self._lock:
+            # Delete messages
+            deleted_messages = self.cursor.execute("DELETE FROM messages WHERE session_id=?", (session_id,)).rowcount
+            print("Messages deleted:", deleted_messages)
+            # Delete stored page text and the collection mapping
+            self.cursor.execute(
+                "DELETE FROM document_pages WHERE doc_id IN (SELECT doc_id FROM documents WHERE session_id=?)",
+                (session_id,)
+            )
+            # Delete the near-duplicate index of its collection
+            for table in ("chunk_signatures", "chunk_lsh", "chunk_links"):
+                self.cursor.execute(f"""
+                    DELETE FROM {table} WHERE collection_name IN (
+                        SELECT collection_name FROM session_collections WHERE session_id=?
+                        UNION SELECT ?
+                    )
+                """, (session_id, session_name))
+            self.cursor.execute("DELETE FROM session_collections WHERE session_id=?", (session_id,))
+            # Delete documents
+            deleted_docs = self.cursor.execute("DELETE FROM documents WHERE session_id=?", (session_id,)).rowcount
+            print("Documents deleted:", deleted_docs)
+            # Delete session
+            deleted_sess = self.cursor.execute("DELETE FROM sessions WHERE session_id=?", (session_id,)).rowcount
+            print("Session deleted:", deleted_sess)
+            self.conn.commit()
+            self._bump("sessions", "documents", "messages", "chunk_links")
         return True
 
+    def get_session_collection(self, session_name):
+        """
+        Returns (collection_name, embedding_model) for a session.
+        Legacy sessions map to (session_name, None).
+        """
+        with self._lock:
+            self.cursor.execute("""
+                SELECT c.collection_name, c.embedding_model
+                FROM sessions s
+                LEFT JOIN session_collections c ON c.session_id = s.session_id
+                WHERE s.session_name = ?
+            """, (session_name,))
+            result = self.cursor.fetchone()
+        if result is None:
+            return None
+        if result[0] is None:
+            return session_name, None
+        return result
+
+    def set_session_collection(self, session_id, collection_name, embedding_model, hnsw_params=None, hnsw_pinned=False):
+        # Single-statement upsert: re-indexing swaps collections atomically through this.
+        updated_at = datetime.now().isoformat()
+        with self._lock:
+            self.cursor.execute("""
+                INSERT INTO session_collections
+                    (session_id, collection_name, embedding_model, hnsw_params, hnsw_pinned, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    collection_name=excluded.collection_name,
+                    embedding_model=excluded.embedding_model,
+                    hnsw_params=excluded.hnsw_params,
+                    hnsw_pinned=excluded.hnsw_pinned,
+                    updated_at=excluded.updated_at
+            """, (session_id, collection_name, embedding_model,
+                  json.dumps(hnsw_params) if hnsw_params else None, int(hnsw_pinned), updated_at))
+            self.conn.commit()
+
+    def swap_session_collection(self, session_id, expected_name, collection_name, embedding_model,
+                                hnsw_params=None, hnsw_pinned=False):
+        """
+        Compare-and-swap for rebuilds and re-indexing: points the session at
+        collection_name only if it is still served by expected_name (a legacy
+        session without a row counts as served by its own name).
+        Returns False if something else swapped it first.
+        """
+        updated_at = datetime.now().isoformat()
+        hnsw_json = json.dumps(hnsw_params) if hnsw_params else None
+        with self._lock:
+            self.cursor.execute("""
+                UPDATE session_collections
+                SET collection_name=?, embedding_model=?, hnsw_params=?, hnsw_pinned=?, updated_at=?
+                WHERE session_id=? AND collection_name=?
+            """, (collection_name, embedding_model, hnsw_json, int(hnsw_pinned), updated_at,
+                  session_id, expected_name))
+            swapped = self.cursor.rowcount == 1
+            if not swapped:
+                self.cursor.execute("""
+                    INSERT INTO session_collections
+                        (session_id, collection_name, embedding_model, hnsw_params, hnsw_pinned, updated_at)
+                    SELECT ?, ?, ?, ?, ?, ? FROM sessions
+                    WHERE session_id=? AND session_name=?
+                      AND NOT EXISTS (SELECT 1 FROM session_collections WHERE session_id=?)
+                """, (session_id, collection_name, embedding_model, hnsw_json, int(hnsw_pinned), updated_at,
+                      session_id, expected_name, session_id))
+                swapped = self.cursor.rowcount == 1
+            self.conn.commit()
+        return swapped
+
+    def get_session_hnsw(self, session_name):
+        """
+        Returns (hnsw_params, pinned) for a session.
+        hnsw_params is None for collections built with Chroma's defaults.
+        """
+        with self._lock:
+            self.cursor.execute("""
+                SELECT c.hnsw_params, c.hnsw_pinned
+                FROM sessions s
+                JOIN session_collections c ON c.session_id = s.session_id
+                WHERE s.session_name = ?
+            """, (session_name,))
+            result = self.cursor.fetchone()
+        if result is None or result[0] is None:
+            return None, bool(result and result[1])
+        return json.loads(result[0]), bool(result[1])
+
      # ------------------- Document Methods -------------------
 
-    def add_document(self, session_id, doc_name, file_path):
-        self.cursor.execute(
-            "INSERT INTO documents (session_id, doc_name, file_path) VALUES (?, ?, ?)",
-            (session_id, doc_name, file_path)
-        )
-        self.conn.commit()
-        return self.cursor.lastrowid
+    def add_document(self, session_id, doc_name, file_path, pages=None):
+        # pages: (page, text), committed with the row so nobody sees a document without its text
+        with self._lock:
+            self.cursor.execute(
+                "INSERT INTO documents (session_id, doc_name, file_path) VALUES (?, ?, ?)",
+                (session_id, doc_name, file_path)
+            )
+            doc_id = self.cursor.lastrowid
+            if pages:
+                self.cursor.executemany(
+                    "INSERT OR REPLACE INTO document_pages (doc_id, page, text) VALUES (?, ?, ?)",
+                    [(doc_id, page, text) for page, text in pages]
+                )
+            self.conn.commit()
+            self._bump("documents")
+            return doc_id
+
+    def delete_document(self, doc_id):
+        # Used to roll back a document whose chunks could not be stored.
+        with self._lock:
+            self.cursor.execute("DELETE FROM document_pages WHERE doc_id=?", (doc_id,))
+            self.cursor.execute("DELETE FROM chunk_links WHERE doc_id=?", (doc_id,))
+            self.cursor.execute("DELETE FROM documents WHERE doc_id=?", (doc_id,))
+            self.conn.commit()
+            self._bump("documents", "chunk_links")
 
     def add_documents_bulk(self, session_id, docs_list):
         entries = [(session_id, os.path.basename(path), path) for path in docs_list]
-        self.cursor.executemany(
-            "INSERT INTO documents (session_id, doc_name, file_path) VALUES (?, ?, ?)",
-            entries
-        )
-        self.conn.commit()
+        with self._lock:
+            self.cursor.executemany(
+                "INSERT INTO documents (session_id, doc_name, file_path) VALUES (?, ?, ?)",
+                entries
+            )
+            self.conn.commit()
+            self._bump("documents")
+
+    def restore_documents(self, session_id, rows):
+        """
+        Inserts (doc_name, file_path) rows in one transaction.
+        Returns the new doc_ids in the same order as rows.
+        """
+        doc_ids = []
+        with self._lock:
+            for doc_name, file_path in rows:
+                self.cursor.execute(
+                    "INSERT INTO documents (session_id, doc_name, file_path) VALUES (?, ?, ?)",
+                    (session_id, doc_name, file_path)
+                )
+                doc_ids.append(self.cursor.lastrowid)
+            self.conn.commit()
+            self._bump("documents")
+        return doc_ids
 
     def get_documents(self, session_id):
-        self.cursor.execute(
-            "SELECT * FROM documents WHERE session_id=?",
-            (session_id,)
-        )
-        return self.cursor.fetchall()
+        def load():
+            self.cursor.execute(
+                "SELECT * FROM documents WHERE session_id=?",
+                (session_id,)
+            )
+            return self.cursor.fetchall()
+        return list(self._cached(("documents", session_id), ("documents",), load))
 
     def get_document_paths(self, session_id):
-        self.cursor.execute(
-            "SELECT file_path FROM documents WHERE session_id=?",
-            (session_id,)
-        )
-        return [row[0] for row in self.cursor.fetchall()]
+        with self._lock:
+            self.cursor.execute(
+                "SELECT file_path FROM documents WHERE session_id=?",
+                (session_id,)
+            )
+            return [row[0] for row in self.cursor.fetchall()]
+
+    def add_pages(self, doc_id, pages):
+        # pages: (page, text)
+        with self._lock:
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO document_pages (doc_id, page, text) VALUES (?, ?, ?)",
+                [(doc_id, page, text) for page, text in pages]
+            )
+            self.conn.commit()
+
+    def get_page_counts(self, session_id):
+        """Returns {doc_id: number of stored pages} for a session's documents."""
+        with self._lock:
+            self.cursor.execute("""
+                SELECT d.doc_id, COUNT(p.page)
+                FROM documents d
+                LEFT JOIN document_pages p ON p.doc_id = d.doc_id
+                WHERE d.session_id = ?
+                GROUP BY d.doc_id
+            """, (session_id,))
+            return dict(self.cursor.fetchall())
+
+    def get_pages(self, doc_id):
+        with self._lock:
+            self.cursor.execute(
+                "SELECT page, text FROM document_pages WHERE doc_id=? ORDER BY page ASC",
+                (doc_id,)
+            )
+            return self.cursor.fetchall()
 
     # ------------------- Message Methods -------------------
 
     def add_message(self, session_id, sender, content):
         timestamp = datetime.now().isoformat()
-        self.cursor.execute(
-            "INSERT INTO messages (session_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
-            (session_id, sender, content, timestamp)
-        )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        with self._lock:
+            self.cursor.execute(
+                "INSERT INTO messages (session_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+                (session_id, sender, content, timestamp)
+            )
+            self.conn.commit()
+            self._bump("messages")
+            return self.cursor.lastrowid
+
+    def add_messages_bulk(self, session_id, rows):
+        # rows: (sender, content, timestamp), timestamps are kept as given.
+        with self._lock:
+            self.cursor.executemany(
+                "INSERT INTO messages (session_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(session_id, sender, content, timestamp) for sender, content, timestamp in rows]
+            )
+            self.conn.commit()
+            self._bump("messages")
 
     def get_messages(self, session_id):
-        self.cursor.execute(
-            "SELECT * FROM messages WHERE session_id=? ORDER BY timestamp ASC",
-            (session_id,)
-        )
-        return self.cursor.fetchall()
+        with self._lock:
+            self.cursor.execute(
+                "SELECT * FROM messages WHERE session_id=? ORDER BY timestamp ASC",
+                (session_id,)
+            )
+            return self.cursor.fetchall()
+
+    def iter_messages(self, session_id, batch_size=1000):
+        """Yields a session's messages in insertion order, batch_size rows at a time."""
+        last_id = 0
+        while True:
+            with self._lock:
+                self.cursor.execute(
+                    "SELECT * FROM messages WHERE session_id=? AND message_id>? ORDER BY message_id ASC LIMIT ?",
+                    (session_id, last_id, batch_size)
+                )
+                rows = self.cursor.fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
 
     def get_latest_message(self, session_id):
-        self.cursor.execute(
-            "SELECT * FROM messages WHERE session_id=? ORDER BY timestamp DESC LIMIT 1",
-            (session_id,)
-        )
-        return self.cursor.fetchone()
+        with self._lock:
+            self.cursor.execute(
+                "SELECT * FROM messages WHERE session_id=? ORDER BY timestamp DESC LIMIT 1",
+                (session_id,)
+            )
+            return self.cursor.fetchone()
 
     def get_last_k_messages_by_name(self, session_name: str, k: int):
         """
         Fetch last k messages using session_name instead of session_id.
         Returns messages in chronological order (oldest → newest).
         """
-        self.cursor.execute("""
-            SELECT m.message_id, m.session_id, m.sender, m.content
-            FROM messages m
-            JOIN sessions s ON m.session_id = s.session_id
-            WHERE s.session_name = ?
-            ORDER BY m.message_id DESC
-            LIMIT ?
-        """, (session_name, k))
+        with self._lock:
+            self.cursor.execute("""
+                SELECT m.message_id, m.session_id, m.sender, m.content
+                FROM messages m
+                JOIN sessions s ON m.session_id = s.session_id
+                WHERE s.session_name = ?
+                ORDER BY m.message_id DESC
+                LIMIT ?
+            """, (session_name, k))
     
-        rows = self.cursor.fetchall()
-        return rows[::-1]  # reverse to chronological order
+            rows = self.cursor.fetchall()
+            return rows[::-1]  # reverse to chronological order
+
+    # ------------------- Near-Duplicate Index Methods -------------------
+
+    def add_chunk_signatures(self, collection_name, rows):
+        # rows: (vector_id, signature_bytes, [bucket, ...])
+        with self._lock:
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO chunk_signatures (collection_name, vector_id, signature) VALUES (?, ?, ?)",
+                [(collection_name, vector_id, signature) for vector_id, signature, _ in rows]
+            )
+            self.cursor.executemany(
+                "INSERT INTO chunk_lsh (collection_name, bucket, vector_id) VALUES (?, ?, ?)",
+                [(collection_name, bucket, vector_id) for vector_id, _, buckets in rows for bucket in buckets]
+            )
+            self.conn.commit()
+
+    def find_signature_candidates(self, collection_name, buckets):
+        """Returns {vector_id: signature_bytes} for vectors sharing any LSH bucket."""
+        placeholders = ",".join("?" * len(buckets))
+        with self._lock:
+            self.cursor.execute(f"""
+                SELECT s.vector_id, s.signature
+                FROM chunk_signatures s
+                WHERE s.collection_name = ? AND s.vector_id IN (
+                    SELECT vector_id FROM chunk_lsh
+                    WHERE collection_name = ? AND bucket IN ({placeholders})
+                )
+            """, (collection_name, collection_name, *buckets))
+            return dict(self.cursor.fetchall())
+
+    def add_chunk_links(self, collection_name, rows):
+        # rows: (vector_id, doc_id, page, text_bytes)
+        with self._lock:
+            self.cursor.executemany(
+                "INSERT INTO chunk_links (collection_name, vector_id, doc_id, page, text_bytes) VALUES (?, ?, ?, ?, ?)",
+                [(collection_name, *row) for row in rows]
+            )
+            self.conn.commit()
+            self._bump("chunk_links")
+
+    def delete_chunk_signatures(self, collection_name, vector_ids):
+        with self._lock:
+            for table in ("chunk_signatures", "chunk_lsh"):
+                self.cursor.executemany(
+                    f"DELETE FROM {table} WHERE collection_name=? AND vector_id=?",
+                    [(collection_name, vector_id) for vector_id in vector_ids]
+                )
+            self.conn.commit()
+
+    def get_link_targets(self, collection_name, vector_ids):
+        """The subset of vector_ids that skipped duplicate chunks are linked to."""
+        targets = set()
+        with self._lock:
+            for start in range(0, len(vector_ids), 500):
+                batch = vector_ids[start:start + 500]
+                self.cursor.execute(
+                    f"SELECT DISTINCT vector_id FROM chunk_links "
+                    f"WHERE collection_name=? AND vector_id IN ({','.join('?' * len(batch))})",
+                    (collection_name, *batch)
+                )
+                targets.update(row[0] for row in self.cursor.fetchall())
+        return targets
+
+    def iter_chunk_links(self, collection_name, batch_size=1000):
+        """Yields (vector_id, doc_id, page, text_bytes), batch_size rows at a time."""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                self.cursor.execute(
+                    "SELECT rowid, vector_id, doc_id, page, text_bytes FROM chunk_links "
+                    "WHERE collection_name=? AND rowid>? ORDER BY rowid ASC LIMIT ?",
+                    (collection_name, last_rowid, batch_size)
+                )
+                rows = self.cursor.fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_rowid = rows[-1][0]
+
+    def get_linked_vectors(self, collection_name, doc_ids=None, pages=None):
+        """Vector ids that stand in for skipped duplicate chunks of the given documents and/or pages."""
+        query = "SELECT DISTINCT vector_id FROM chunk_links WHERE collection_name = ?"
+        params = [collection_name]
+        if doc_ids:
+            query += f" AND doc_id IN ({','.join('?' * len(doc_ids))})"
+            params += list(doc_ids)
+        if pages:
+            query += " AND page BETWEEN ? AND ?"
+            params += [pages[0], pages[1]]
+        with self._lock:
+            self.cursor.execute(query, params)
+            return [row[0] for row in self.cursor.fetchall()]
+
+    def get_dedup_stats(self, collection_name):
+        """Returns (indexed_chunks, linked_duplicates, duplicate_text_bytes)."""
+        with self._lock:
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM chunk_signatures WHERE collection_name=?", (collection_name,)
+            )
+            indexed = self.cursor.fetchone()[0]
+            self.cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(text_bytes), 0) FROM chunk_links WHERE collection_name=?",
+                (collection_name,)
+            )
+            linked, text_bytes = self.cursor.fetchone()
+        return indexed, linked, text_bytes
+
+    def rename_dedup_collection(self, old_name, new_name):
+        # The HNSW rebuild keeps vector ids, so the index just moves with the collection.
+        with self._lock:
+            for table in ("chunk_signatures", "chunk_lsh", "chunk_links"):
+                self.cursor.execute(
+                    f"UPDATE {table} SET collection_name=? WHERE collection_name=?", (new_name, old_name)
+                )
+            self.conn.commit()
+            self._bump("chunk_links")
+
+    def clear_dedup_collection(self, collection_name, include_links=True):
+        tables = ("chunk_signatures", "chunk_lsh", "chunk_links") if include_links else ("chunk_signatures", "chunk_lsh")
+        with self._lock:
+            for table in tables:
+                self.cursor.execute(f"DELETE FROM {table} WHERE collection_name=?", (collection_name,))
+            self.conn.commit()
+            self._bump("chunk_links")
+
+    # ------------------- Import Manifest Methods -------------------
+
+    def get_manifest_entry(self, file_path):
+        with self._lock:
+            self.cursor.execute(
+                "SELECT file_path, session_id, file_size, file_mtime, status, chunks, error, doc_id "
+                "FROM import_manifest WHERE file_path=?",
+                (file_path,)
+            )
+            return self.cursor.fetchone()
+
+    def set_manifest_status(self, file_path, session_id, file_size, file_mtime, status, chunks=None, error=None):
+        updated_at = datetime.now().isoformat()
+        with self._lock:
+            self.cursor.execute("""
+                INSERT INTO import_manifest
+                    (file_path, session_id, file_size, file_mtime, status, chunks, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(file_path) DO UPDATE SET
+                    session_id=excluded.session_id,
+                    file_size=excluded.file_size,
+                    file_mtime=excluded.file_mtime,
+                    status=excluded.status,
+                    chunks=excluded.chunks,
+                    error=excluded.error,
+                    updated_at=excluded.updated_at
+            """, (file_path, session_id, file_size, file_mtime, status, chunks, error, updated_at))
+            self.conn.commit()
 
     # ------------------- Cleanup -------------------
+    def manifest_has_folder(self, session_id, folder):
+        """True if files under folder were imported into session_id before."""
+        prefix = os.path.join(folder, "")
+        with self._lock:
+            self.cursor.execute(
+                "SELECT 1 FROM import_manifest WHERE session_id=? AND substr(file_path, 1, ?)=? LIMIT 1",
+                (session_id, len(prefix), prefix)
+            )
+            return self.cursor.fetchone() is not None
+
+    def set_manifest_doc(self, file_path, doc_id):
+        with self._lock:
+            self.cursor.execute("UPDATE import_manifest SET doc_id=? WHERE file_path=?", (doc_id, file_path))
+            self.conn.commit()
+
     def close(self):
         self.conn.close()
 
 
 
+def load_embedding_engine(model_name):
+    """
+    Returns the embedding engine for model_name: the shared embedding server
+    when EMBEDDING_SERVER_SOCKET points at one serving that model, otherwise
+    an in-process HuggingFace model.
+    """
+    socket_path = os.environ.get("EMBEDDING_SERVER_SOCKET")
+    if socket_path:
+        remote = connect_remote_embeddings(socket_path, model_name)
+        if remote is not None:
+            return remote
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+# (largest expected chunk count, M, construction_ef, search_ef).
+# Small sessions get cheap graphs; large ones buy recall with wider graphs and searches.
+HNSW_TIERS = [
+    (1_000, 8, 64, 32),
+    (10_000, 16, 100, 64),
+    (100_000, 32, 200, 128),
+    (None, 48, 400, 256),
+]
+HNSW_SPACE = "l2"  # Chroma's default; RAGAssistant's score threshold assumes it
+
+
+def hnsw_params(expected_size, space=HNSW_SPACE):
+    """Chroma collection metadata for the HNSW tier that fits expected_size chunks."""
+    for max_size, m, construction_ef, search_ef in HNSW_TIERS:
+        if max_size is None or expected_size <= max_size:
+            return {
+                "hnsw:space": space,
+                "hnsw:M": m,
+                "hnsw:construction_ef": construction_ef,
+                "hnsw:search_ef": search_ef,
+            }
+
+
+def collection_metadata(model_name, hnsw=None):
+    # Must be identical every time a collection is opened: Chroma rewrites the
+    # stored metadata when it differs, and its HNSW segment reads params from it.
+    metadata = {"embedding_model": model_name}
+    if hnsw:
+        metadata.update(hnsw)
+    return metadata
+
+
+def versioned_collection_name(session_name, tag):
+    # Chroma caps collection names at 63 characters; trim the session part, keep the suffix.
+    suffix = f"_{tag}{int(time.time())}"
+    return session_name[:63 - len(suffix)].rstrip("_-.") + suffix
+
+
+def _retire_collection(database, persist_dir, old_name, new_name, batch_size=1000):
+    """
+    Drops a collection that has been swapped out, after copying over vectors
+    (and moving dedup rows) written to it by callers that opened it before the swap.
+    """
+    try:
+        old = Chroma(collection_name=old_name, persist_directory=persist_dir)._collection
+        new = Chroma(collection_name=new_name, persist_directory=persist_dir)._collection
+        missing = []
+        offset = 0
+        while True:
+            batch = old.get(limit=batch_size, offset=offset, include=[])
+            if not batch["ids"]:
+                break
+            present = set(new.get(ids=batch["ids"], include=[])["ids"])
+            missing.extend(vector_id for vector_id in batch["ids"] if vector_id not in present)
+            offset += len(batch["ids"])
+        for start in range(0, len(missing), batch_size):
+            rows = old.get(ids=missing[start:start + batch_size], include=["embeddings", "documents", "metadatas"])
+            new.add(ids=rows["ids"], embeddings=rows["embeddings"],
+                    documents=rows["documents"], metadatas=rows["metadatas"])
+        database.rename_dedup_collection(old_name, new_name)
+        Chroma(collection_name=old_name, persist_directory=persist_dir).delete_collection()
+        if missing:
+            print(f"[INFO] Copied {len(missing)} late vector(s) from '{old_name}' before dropping it.")
+    except Exception as e:
+        print(f"[ERROR] Failed to drop retired collection '{old_name}': {e}")
+
+
+# One rebuild per session at a time within a process; swap_session_collection
+# guards against rebuilds and re-indexes running in other processes.
+_rebuild_locks = {}
+_rebuild_locks_guard = threading.Lock()
+
+
+_retire_timers = []
+
+
+def wait_for_retired_collections():
+    """Blocks until pending grace-period drops have run; call before closing the Database."""
+    while _retire_timers:
+        _retire_timers.pop().join()
+
+
+def _rebuild_lock(session_name):
+    with _rebuild_locks_guard:
+        return _rebuild_locks.setdefault(session_name, threading.Lock())
+
+
+def rebuild_collection(database, persist_dir, session_name, hnsw, pinned=False, batch_size=1000, grace_seconds=5):
+    """
+    Copies a session's vectors (ids, embeddings, texts, metadata) into a new
+    collection built with the given HNSW params, then swaps it in. The old
+    collection is dropped after grace_seconds on a background thread, so
+    in-flight queries and uploads on it can finish. Nothing is re-embedded.
+    Returns the new collection name, or None if another rebuild or re-index
+    swapped the session first (the new collection is then dropped).
+    """
+    with _rebuild_lock(session_name):
+        return _rebuild(database, persist_dir, session_name, hnsw, pinned, batch_size, grace_seconds)
+
+
+def _rebuild(database, persist_dir, session_name, hnsw, pinned=False, batch_size=1000, grace_seconds=5):
+    session_id = database.get_session_id(session_name)
+    old_name, model_name = database.get_session_collection(session_name)
+    # Legacy sessions have no recorded model; they were built with EMBEDDING_MODEL.
+    model_name = model_name or os.environ.get("EMBEDDING_MODEL")
+    new_name = versioned_collection_name(session_name, "h")
+    old = Chroma(collection_name=old_name, persist_directory=persist_dir)._collection
+    new = Chroma(
+        collection_name=new_name,
+        persist_directory=persist_dir,
+        collection_metadata=collection_metadata(model_name, hnsw)
+    )
+    try:
+        offset = 0
+        while True:
+            batch = old.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            new._collection.add(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"]
+            )
+            offset += len(batch["ids"])
+    except Exception:
+        new.delete_collection()
+        raise
+    if not database.swap_session_collection(session_id, old_name, new_name, model_name,
+                                            hnsw_params=hnsw, hnsw_pinned=pinned):
+        # The session moved on while we copied; ours is stale and the dedup rows stay put.
+        new.delete_collection()
+        print(f"[WARN] '{session_name}' was swapped to another collection during the rebuild; discarded '{new_name}'.")
+        return None
+    database.rename_dedup_collection(old_name, new_name)
+    if grace_seconds:
+        # Not a daemon: a CLI waits for the drop instead of leaking the old collection.
+        timer = threading.Timer(grace_seconds, _retire_collection, (database, persist_dir, old_name, new_name))
+        timer.start()
+        _retire_timers.append(timer)
+    else:
+        _retire_collection(database, persist_dir, old_name, new_name)
+    print(f"[INFO] Rebuilt '{session_name}' with M={hnsw['hnsw:M']}, "
+          f"construction_ef={hnsw['hnsw:construction_ef']}, search_ef={hnsw['hnsw:search_ef']} "
+          f"({offset} vectors).")
+    return new_name
+
+
+def maybe_retune(database, persist_dir, session_name):
+    """
+    Rebuilds a session's index with a larger HNSW tier once it has outgrown
+    the current one. Pinned sessions are left alone, and so is a session this
+    process is already rebuilding. The rebuild copies every vector, so the
+    caller (add_file, at the end of an upload) blocks for the copy; it only
+    happens when a tier boundary is crossed.
+    Returns True if a rebuild happened.
+    """
+    lock = _rebuild_lock(session_name)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        hnsw, pinned = database.get_session_hnsw(session_name)
+        if pinned:
+            return False
+        collection_name, _ = database.get_session_collection(session_name)
+        count = Chroma(collection_name=collection_name, persist_directory=persist_dir)._collection.count()
+        target = hnsw_params(count)
+        # Only grow: shrinking after deletes is not worth a rebuild.
+        if hnsw and hnsw.get("hnsw:M", 0) >= target["hnsw:M"]:
+            return False
+        return _rebuild(database, persist_dir, session_name, target) is not None
+    finally:
+        lock.release()
+
+
+def purge_document(database, collection, doc_id, vector_ids=None):
+    """
+    Removes a document row with its page text and dedup links, plus the vectors
+    tagged with it (all of them unless vector_ids is given). Vectors that other
+    documents' skipped duplicates are linked to are kept, as those documents
+    still rely on them.
+    """
+    collection_name = collection._collection.name
+    if vector_ids is None:
+        vector_ids = collection._collection.get(where={"doc_id": doc_id}, include=[])["ids"]
+    database.delete_document(doc_id)
+    if vector_ids:
+        linked = database.get_link_targets(collection_name, vector_ids)
+        drop = [vector_id for vector_id in vector_ids if vector_id not in linked]
+        if drop:
+            collection._collection.delete(ids=drop)
+            database.delete_chunk_signatures(collection_name, drop)
+
+
+def build_text_splitter(embedding_engine):
+    # Shared by vectordb and the bulk importer workers so both chunk identically.
+    return SemanticChunker(
+        embedding_engine,
+        breakpoint_threshold_type="percentile",
+        breakpoint_threshold_amount=85
+    )
+
+
+def page_rows(document):
+    # (page, text) rows for Database.add_pages from loaded page Documents.
+    return [
+        (page.metadata.get("page", idx), page.page_content)
+        for idx, page in enumerate(document)
+    ]
+
+
+def tag_chunks(chunks, doc_id):
+    """
+    Attaches doc_id and the page range each chunk came from to its metadata,
+    so retrieval can be scoped with retrieval_filter. Chunks never span pages
+    (pages are split independently), so the range is the loader's page.
+    """
+    for chunk in chunks:
+        page = chunk.metadata.get("page", 0)
+        chunk.metadata["doc_id"] = doc_id
+        chunk.metadata["page_start"] = page
+        chunk.metadata["page_end"] = page
+    return chunks
+
+
+# Scopes whose linked near-duplicate vectors vectordb keeps in memory (LRU).
+LINKED_CACHE_SCOPES = 32
+
+
+def retrieval_filter(doc_ids=None, pages=None):
+    """
+    Builds a Chroma `where` filter scoping a search to some documents and/or
+    an inclusive, 0-based (first_page, last_page) range. Returns None for no scope.
+    """
+    conditions = []
+    if doc_ids:
+        doc_ids = [int(d) for d in doc_ids]
+        conditions.append({"doc_id": doc_ids[0]} if len(doc_ids) == 1 else {"doc_id": {"$in": doc_ids}})
+    if pages:
+        first_page, last_page = pages
+        # A chunk matches when its page range overlaps the requested one.
+        conditions.append({"page_start": {"$lte": int(last_page)}})
+        conditions.append({"page_end": {"$gte": int(first_page)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def load_pdf(item):
+    """
+    Loads a PDF into one Document per page.
+    Accepts a file path (CLI compatibility) or a file-like object (Streamlit compatibility).
+    Returns (pages, doc_name, doc_path).
+    """
+    if isinstance(item, str):
+        loader = PyPDFLoader(item)
+        return loader.load(), os.path.basename(item), item
+
+    # item is likely an UploadedFile or BytesIO
+    reader = PdfReader(item)
+    document = []
+    for page_idx, page in enumerate(reader.pages):
+        text = page.extract_text()
+        document.append(Document(
+            page_content=text,
+            metadata={"source": item.name, "page": page_idx}
+        ))
+    return document, item.name, f"in-memory://{item.name}"
+
+
+def store_upload(item, upload_dir):
+    """
+    Persists an in-memory upload under a content-addressed path
+    (upload_dir/<first two hex chars>/<sha256>.pdf) and returns that path.
+    Identical bytes are written once, and same-named files never collide.
+    """
+    with item.getbuffer() as buffer:
+        digest = hashlib.sha256(buffer).hexdigest()
+        blob_dir = os.path.join(upload_dir, digest[:2])
+        blob_path = os.path.join(blob_dir, f"{digest}.pdf")
+        if not os.path.exists(blob_path):
+            os.makedirs(blob_dir, exist_ok=True)
+            # Write to a temp file and rename so concurrent uploads never see a partial blob.
+            fd, tmp_path = tempfile.mkstemp(dir=blob_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(buffer)
+            os.replace(tmp_path, blob_path)
+    item.seek(0)
+    return blob_path
+
+
 class vectordb:
-    def __init__(self, db_path="studymate.db", persist_dir="./chroma_db"):
+    def __init__(self, db_path="studymate.db", persist_dir="./chroma_db", upload_dir=None, dedup_threshold=0.85):
         self.embedding_model_name = os.environ.get("EMBEDDING_MODEL")
-        self.embedding_engine = HuggingFaceEmbeddings(
-            model_name=self.embedding_model_name
-        )
+        # One engine (and splitter) per model name, so sessions built with an older
+        # model keep working until they are re-indexed.
+        self._embedding_engines = {}
+        self._text_splitters = {}
+        self.embedding_engine = self.get_embedding_engine(self.embedding_model_name)
         self.persist_directory = persist_dir
+        self.upload_dir = upload_dir
         self.database = Database(db_path=db_path)
         self.database._create_tables()
-        self.textsplitter = SemanticChunker(
-            self.embedding_engine,
-            breakpoint_threshold_type="percentile",
-            breakpoint_threshold_amount=85
-        )
+        self.textsplitter = self.get_text_splitter(self.embedding_model_name)
+        # Near-duplicate chunks are skipped before embedding; None disables it.
+        self.dedup = ChunkDeduplicator(self.database, threshold=dedup_threshold) if dedup_threshold else None
+        self._linked_cache = OrderedDict()  # scope -> (chunk_links version, linked vectors), LRU
+        self._linked_lock = threading.Lock()
         print("Vector database initialized successfully.")
 
+    def get_embedding_engine(self, model_name):
+        if model_name not in self._embedding_engines:
+            self._embedding_engines[model_name] = load_embedding_engine(model_name)
+        return self._embedding_engines[model_name]
+
+    def get_text_splitter(self, model_name):
+        if model_name not in self._text_splitters:
+            self._text_splitters[model_name] = build_text_splitter(self.get_embedding_engine(model_name))
+        return self._text_splitters[model_name]
+
+    def get_session_model(self, session_name):
+        """
+        Returns (collection_name, embedding_model) serving a session.
+        Legacy sessions with no recorded model are assumed to use EMBEDDING_MODEL.
+        """
+        collection_name, model_name = self.database.get_session_collection(session_name)
+        return collection_name, model_name or self.embedding_model_name
+
+    def open_collection(self, collection_name, model_name, hnsw=None):
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=self.get_embedding_engine(model_name),
+            persist_directory=self.persist_directory,
+            collection_metadata=collection_metadata(model_name, hnsw)
+        )
+
+    def open_session_collection(self, session_name):
+        # Opens the collection currently serving a session, with its recorded model and HNSW params.
+        collection_name, model_name = self.get_session_model(session_name)
+        hnsw, _ = self.database.get_session_hnsw(session_name)
+        return self.open_collection(collection_name, model_name, hnsw)
+
+
 
     def _save_session_name(self, session_name, subject_category):
         id = self.database.add_session(session_name, subject_category)
@@ -238,14 +1106,14 @@ class vectordb:
         if self.database.session_exists(session_name):  ## Query function 1
             return False  # session exists, do not create
         
-        # Create new Chroma collection
-        collection = Chroma(
-            collection_name=session_name,
-            embedding_function=self.embedding_engine,
-            persist_directory=self.persist_directory
-        )
+        # Create new Chroma collection, tagged with the model that fills it.
+        # New sessions start on the smallest HNSW tier and are re-tuned as they grow.
+        hnsw = hnsw_params(0)
+        collection = self.open_collection(session_name, self.embedding_model_name, hnsw)
         # Persist the session name
         self._save_session_name(session_name, subject_category)
+        session_id = self.database.get_session_id(session_name)
+        self.database.set_session_collection(session_id, session_name, self.embedding_model_name, hnsw_params=hnsw)
         return True
 
     def list_sessions(self):
@@ -270,23 +1138,90 @@ class vectordb:
         if not self.database.session_exists(session_name):
            print(f"Session {session_name} not exist in the database.") 
            return None
-        return Chroma(
-             collection_name=session_name,
-             embedding_function=self.embedding_engine,
-             persist_directory=self.persist_directory
-             )
+        _, model_name = self.get_session_model(session_name)
+        if model_name != self.embedding_model_name:
+            print(f"[WARN] Session '{session_name}' was embedded with '{model_name}'; "
+                  f"re-index it to use '{self.embedding_model_name}'.")
+        # Queries must be embedded with the model that built the collection.
+        return self.open_session_collection(session_name)
+
+
+    def similarity_search(self, session_name, question, k=5, doc_ids=None, pages=None):
+        """
+        Scoped similarity search returning (Document, distance) pairs.
+        With a document or page scope, vectors that stand in for the scope's skipped
+        near-duplicate chunks are scored as well, so deduplication never hides them.
+        """
+        collection = self.get_session(session_name)
+        where = retrieval_filter(doc_ids, pages)
+        if where is None:
+            return collection.similarity_search_with_score(question, k=k, filter=where)
+
+        # Embed once and reuse it for both the filtered search and the linked vectors.
+        embedding = collection._embedding_function.embed_query(question)
+        results = collection.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+        collection_name, _ = self.get_session_model(session_name)
+        linked = self._linked_vectors(collection, collection_name, doc_ids, pages)
+        if linked is None:
+            return results
+
+        texts, metadatas, vectors = linked
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        # Same distance Chroma reports for the collection's HNSW space.
+        space = (collection._collection.metadata or {}).get("hnsw:space", HNSW_SPACE)
+        if space == "cosine":
+            distances = 1 - vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector))
+        elif space == "ip":
+            distances = 1 - vectors @ query_vector
+        else:
+            distances = ((vectors - query_vector) ** 2).sum(axis=1)
+
+        seen = {doc.page_content for doc, _ in results}
+        for text, metadata, distance in zip(texts, metadatas, distances):
+            if text not in seen:
+                results.append((Document(page_content=text, metadata=metadata or {}), float(distance)))
+        return sorted(results, key=lambda pair: pair[1])[:k]
+
+    def _linked_vectors(self, collection, collection_name, doc_ids, pages):
+        """
+        (texts, metadatas, float32 matrix) of the vectors linked to a scope, or None.
+        Cached per scope until chunk_links changes, so repeated questions on a
+        mostly-duplicate document don't reload its linked vectors every time.
+        """
+        key = (collection_name, tuple(sorted(doc_ids or ())), tuple(pages) if pages else None)
+        version = self.database.get_version("chunk_links")
+        with self._linked_lock:
+            hit = self._linked_cache.get(key)
+            if hit is not None and hit[0] == version:
+                self._linked_cache.move_to_end(key)
+                return hit[1]
+
+        value = None
+        linked_ids = self.database.get_linked_vectors(collection_name, doc_ids, pages)
+        if linked_ids:
+            linked = collection._collection.get(ids=linked_ids, include=["embeddings", "documents", "metadatas"])
+            if linked["ids"]:
+                value = (linked["documents"], linked["metadatas"], np.asarray(linked["embeddings"], dtype=np.float32))
 
+        with self._linked_lock:
+            self._linked_cache[key] = (version, value)
+            self._linked_cache.move_to_end(key)
+            while len(self._linked_cache) > LINKED_CACHE_SCOPES:
+                self._linked_cache.popitem(last=False)
+        return value
 
-    def chunk_document(self, document):
+    def chunk_document(self, document, model_name=None):
         # Splits a loaded document into chunks using predefined splitter.
-        # Thin wrapper function; mainly for readability and future extensibility.
-        chunks = self.textsplitter.split_documents(document)
+        # Semantic chunking embeds sentences, so it uses the collection's model.
+        splitter = self.get_text_splitter(model_name or self.embedding_model_name)
+        chunks = splitter.split_documents(document)
         return chunks
 
 
     def add_file(self, documents_list, session_name):
         """
         Adds one or more PDF documents to a given session.
+        Items may be file paths or in-memory uploads (e.g. Streamlit UploadedFile).
         Updates both Chroma collection and SQLite database.
         Assumes session existence has already been validated.
         """
@@ -294,54 +1229,77 @@ class vectordb:
         session_id = self.database.get_session_id(session_name)
     
         # Instantiate Chroma collection for this session
-        collection = Chroma(
-            collection_name=session_name,
-            embedding_function=self.embedding_engine,
-            persist_directory=self.persist_directory
-        )
+        collection_name, model_name = self.get_session_model(session_name)
+        collection = self.open_session_collection(session_name)
+        total_chunks = skipped_chunks = skipped_bytes = embedded_chunks = 0
+        embed_seconds = 0.0
     
         # Process each document
         for i, item in enumerate(documents_list, start=1):
             try:
-                if isinstance(item, str):
-                    # Handle as file path (CLI compatibility)
-                    if not os.path.exists(item):
-                        print(f"[WARN] File '{item}' not found, skipping.")
-                        continue
-                    loader = PyPDFLoader(item)
-                    document = loader.load()
-                    doc_name = os.path.basename(item)
-                    doc_path = item
-                else:
-                    # Handle as file-like object (Streamlit compatibility)
-                    # item is likely an UploadedFile or BytesIO
-                    reader = PdfReader(item)
-                    document = []
-                    for page_idx, page in enumerate(reader.pages):
-                        text = page.extract_text()
-                        document.append(Document(
-                            page_content=text, 
-                            metadata={"source": item.name, "page": page_idx}
-                        ))
-                    doc_name = item.name
-                    doc_path = f"in-memory://{item.name}"
-
-                # Chunk the document
-                chunks = self.chunk_document(document)
-    
-                # Add chunks to Chroma
-                collection.add_documents(chunks)
-    
-                # Save document metadata to SQLite
-                self.database.add_document(session_id, doc_name, doc_path)
+                if isinstance(item, str) and not os.path.exists(item):
+                    print(f"[WARN] File '{item}' not found, skipping.")
+                    continue
+                document, doc_name, doc_path = load_pdf(item)
+                if not isinstance(item, str) and self.upload_dir:
+                    # Parsed straight from memory; the bytes are only kept for reference.
+                    doc_path = store_upload(item, self.upload_dir)
+
+                # Save document metadata and page text to SQLite first,
+                # so every chunk can carry its doc_id
+                doc_id = self.database.add_document(session_id, doc_name, doc_path, pages=page_rows(document))
+                stored_ids = []
+                try:
+                    # Chunk the document
+                    chunks = tag_chunks(self.chunk_document(document, model_name), doc_id)
+                    ids = [str(uuid.uuid4()) for _ in chunks]
+
+                    # Drop near-duplicates of chunks already in the session before embedding
+                    signatures, duplicates = [], []
+                    if self.dedup and chunks:
+                        unique, signatures, duplicates = self.dedup.split(collection_name, chunks, ids)
+                        chunks = [chunks[j] for j in unique]
+                        ids = [ids[j] for j in unique]
+
+                    # Add chunks to Chroma
+                    started = time.perf_counter()
+                    if chunks:
+                        stored_ids = ids
+                        collection.add_documents(chunks, ids=ids)
+                    embed_seconds += time.perf_counter() - started
+
+                    if self.dedup:
+                        self.dedup.register(collection_name, ids, signatures)
+                        self.dedup.link(collection_name, duplicates)
+                except Exception:
+                    # Also drop vectors already added, or they would surface in unscoped retrieval.
+                    purge_document(self.database, collection, doc_id, vector_ids=stored_ids)
+                    raise
+
+                total_chunks += len(chunks) + len(duplicates)
+                embedded_chunks += len(chunks)
+                skipped_chunks += len(duplicates)
+                skipped_bytes += sum(len(chunk.page_content.encode("utf-8")) for _, chunk in duplicates)
     
                 print(f"[INFO] Document {i}: '{doc_name}' added successfully.")
     
             except Exception as e:
                 print(f"[ERROR] Failed to add document {i}: {e}")
 
-    
-    
+        if skipped_chunks:
+            # Per-chunk cost of what was actually embedded, applied to what was skipped.
+            per_chunk = embed_seconds / embedded_chunks if embedded_chunks else 0.0
+            print(f"[INFO] Near-duplicates: skipped {skipped_chunks}/{total_chunks} chunks "
+                  f"({skipped_chunks / total_chunks * 100:.1f}%), saving ~{per_chunk * skipped_chunks:.1f}s "
+                  f"of embedding and {skipped_bytes / 1e3:.1f} KB of chunk text plus their vectors.")
+
+        # Move to a larger HNSW tier if these documents pushed the session past its current one
+        # (this copies every vector, so the upload waits for it when a tier boundary is crossed)
+        try:
+            maybe_retune(self.database, self.persist_directory, session_name)
+        except Exception as e:
+            print(f"[ERROR] Failed to re-tune index for '{session_name}': {e}")
+
 
     def delete_session(self, session_name):
         deleted = self.database.delete_session(session_name)
@@ -429,11 +1387,13 @@ class RAGAssistant:
         return ChatPromptTemplate.from_messages([system_msg, human_msg])
 
     # ---------------- Query ----------------
-    def query(self, session_name: str, question: str, n_results: int = 5):
+    def query(self, session_name: str, question: str, n_results: int = 5, doc_ids=None, pages=None):
         """
         Retrieve relevant chunks and past conversation,
         decide which prompt to use (strict or general),
         then stream output.
+        doc_ids / pages (0-based, inclusive) optionally scope retrieval;
+        the filter is applied inside the vector search.
         """
         # ---------------- Memory ----------------
         last_messages = self.vector_db.database.get_last_k_messages_by_name(session_name, 6)
@@ -443,12 +1403,13 @@ class RAGAssistant:
             memory_text += f"{role}: {m[3]}\n"
 
         # ---------------- Session & Docs ----------------
-        collection = self.vector_db.get_session(session_name)
         subject_category = self.vector_db.database.get_subject_category(session_name)
 
 
         # Similarity search
-        docs_with_scores = collection.similarity_search_with_score(question, k=n_results)
+        docs_with_scores = self.vector_db.similarity_search(
+            session_name, question, k=n_results, doc_ids=doc_ids, pages=pages
+        )
         # Filter by threshold
         filtered_docs = [doc for doc, score in docs_with_scores if score >= self.similarity_threshold]
         
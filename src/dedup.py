@@ -0,0 +1,194 @@
+"""
+Near-duplicate chunk detection with MinHash + LSH.
+
+Course packs repeat boilerplate pages, exercise sets and appendix tables
+across PDFs and editions. Before chunks are embedded, each one gets a MinHash
+signature over its word shingles. The signature is split into LSH bands, and
+the band buckets are looked up in SQLite (`chunk_lsh`) to find candidate
+matches cheaply. A candidate whose estimated Jaccard similarity reaches the
+threshold counts as a duplicate. The chunk is then not embedded or stored.
+Instead, a row in `chunk_links` records its document and page against the
+existing vector, so document-scoped retrieval still finds it.
+
+The index is keyed by Chroma collection name, so a shadow collection built
+during re-indexing has its own index until it is swapped in.
+
+Example:
+    python src/dedup.py report physics_101      # savings so far
+    python src/dedup.py backfill physics_101    # index chunks stored before dedup existed
+"""
+import argparse
+import hashlib
+import os
+import re
+import zlib
+
+import numpy as np
+from langchain_chroma import Chroma
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHROMA_DIR = os.path.join(PROJECT_ROOT, "chroma_db")
+DB_PATH = os.path.join(PROJECT_ROOT, "studymate.db")
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_TOKEN = re.compile(r"\w+")
+
+
+class ChunkDeduplicator:
+    def __init__(self, database, threshold=0.85, num_perm=128, bands=16, shingle_size=5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.database = database
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Fixed seed: signatures are persisted and must be comparable across processes and runs.
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    # ---------------- Signatures ----------------
+    def _shingles(self, text):
+        tokens = _TOKEN.findall(text.lower())
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)}
+        return {" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) % _MERSENNE_PRIME for s in self._shingles(text)),
+            dtype=np.uint64
+        )
+        # Universal hashing (a * h + b) mod p with everything < p = 2**31 - 1:
+        # products stay below 2**62, so uint64 never overflows.
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def buckets(self, signature):
+        # One bucket id per band; the band index is hashed in so bands never collide.
+        result = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(
+                band.to_bytes(2, "big") + signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                digest_size=8
+            ).digest()
+            result.append(int.from_bytes(digest, "big", signed=True))
+        return result
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        return float(np.mean(sig_a == sig_b))
+
+    # ---------------- Index ----------------
+    def find_duplicates(self, collection_name, chunks, ids, signatures=None):
+        """
+        Checks chunks against the collection's index and against earlier chunks
+        in the same call.
+        Returns (signatures, matches) where matches[i] is the vector id chunk i
+        duplicates, or None if it is new.
+        """
+        if signatures is None:
+            signatures = [self.signature(chunk.page_content) for chunk in chunks]
+        matches = []
+        pending = {}  # bucket -> [(vector_id, signature)] for new chunks in this call
+        for vector_id, signature in zip(ids, signatures):
+            buckets = self.buckets(signature)
+            candidates = self.database.find_signature_candidates(collection_name, buckets)
+            candidates = {vid: np.frombuffer(blob, dtype=np.uint32) for vid, blob in candidates.items()}
+            for bucket in buckets:
+                for pending_id, pending_sig in pending.get(bucket, []):
+                    candidates[pending_id] = pending_sig
+
+            best_id, best = None, self.threshold
+            for candidate_id, candidate_sig in candidates.items():
+                score = self.similarity(signature, candidate_sig)
+                if score >= best:
+                    best_id, best = candidate_id, score
+            matches.append(best_id)
+            if best_id is None:
+                for bucket in buckets:
+                    pending.setdefault(bucket, []).append((vector_id, signature))
+        return signatures, matches
+
+    def register(self, collection_name, ids, signatures):
+        self.database.add_chunk_signatures(collection_name, [
+            (vector_id, signature.tobytes(), self.buckets(signature))
+            for vector_id, signature in zip(ids, signatures)
+        ])
+
+    def link(self, collection_name, duplicates):
+        # duplicates: (existing vector_id, skipped chunk)
+        self.database.add_chunk_links(collection_name, [
+            (vector_id, chunk.metadata.get("doc_id"), chunk.metadata.get("page"),
+             len(chunk.page_content.encode("utf-8")))
+            for vector_id, chunk in duplicates
+        ])
+
+    def split(self, collection_name, chunks, ids, signatures=None):
+        """
+        Convenience wrapper used by the ingest paths.
+        Returns (unique_indexes, unique_signatures, duplicates) where duplicates
+        are (existing vector_id, chunk) pairs ready for link().
+        """
+        signatures, matches = self.find_duplicates(collection_name, chunks, ids, signatures)
+        unique = [i for i, match in enumerate(matches) if match is None]
+        duplicates = [(match, chunks[i]) for i, match in enumerate(matches) if match is not None]
+        return unique, [signatures[i] for i in unique], duplicates
+
+    def backfill(self, collection_name, persist_dir, batch_size=1000):
+        """Indexes chunks already stored in a collection. Returns the number indexed."""
+        collection = Chroma(collection_name=collection_name, persist_directory=persist_dir)._collection
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["documents"])
+            if not batch["ids"]:
+                break
+            self.register(collection_name, batch["ids"], [self.signature(text or "") for text in batch["documents"]])
+            offset += len(batch["ids"])
+        return offset
+
+
+def report(database, persist_dir, session_name):
+    collection_name, _ = database.get_session_collection(session_name)
+    collection = Chroma(collection_name=collection_name, persist_directory=persist_dir)._collection
+    stored = collection.count()
+    indexed, linked, text_bytes = database.get_dedup_stats(collection_name)
+    sample = collection.get(limit=1, include=["embeddings"])
+    dim = len(sample["embeddings"][0]) if sample["ids"] else 0
+    total = stored + linked
+    print(f"---- Near-duplicate report: {session_name} ----")
+    print(f"Chunks seen:        {total}")
+    print(f"Stored vectors:     {stored} ({indexed} indexed for dedup)")
+    print(f"Skipped duplicates: {linked} ({linked / total * 100 if total else 0:.1f}% of chunks)")
+    print(f"Index size saved:   ~{(linked * dim * 4 + text_bytes) / 1e6:.2f} MB "
+          f"({dim}-dim float32 vectors + chunk text)")
+    print("-----------------------------------------------")
+
+
+def main():
+    from classes import Database
+
+    parser = argparse.ArgumentParser(description="Inspect or backfill the near-duplicate chunk index.")
+    parser.add_argument("command", choices=["report", "backfill"])
+    parser.add_argument("session_name")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path.")
+    parser.add_argument("--chroma", default=CHROMA_DIR, help="Chroma persistence directory.")
+    args = parser.parse_args()
+
+    database = Database(db_path=args.db)
+    if database.get_session_collection(args.session_name) is None:
+        print(f"[ERROR] Session '{args.session_name}' does not exist.")
+        raise SystemExit(1)
+    if args.command == "backfill":
+        collection_name, _ = database.get_session_collection(args.session_name)
+        database.clear_dedup_collection(collection_name, include_links=False)
+        n = ChunkDeduplicator(database).backfill(collection_name, args.chroma)
+        print(f"[INFO] Indexed {n} chunks of '{args.session_name}'.")
+    report(database, args.chroma, args.session_name)
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Shared embedding service for all StudyMate processes on a host.
+
+Without it, every Streamlit worker (and every CLI) loads its own copy of the
+HuggingFace model and embeds one query at a time. The server loads the model
+once, listens on a Unix socket, and merges concurrent requests into
+micro-batches: a batch is closed when it reaches --max-batch texts or when its
+oldest request has waited --max-wait-ms. Query embeddings are always taken
+from the queue ahead of bulk ingestion (document chunks, semantic chunking).
+
+Clients opt in by setting EMBEDDING_SERVER_SOCKET; vectordb then uses
+RemoteEmbeddings instead of an in-process model.
+
+Example:
+    python src/embedding_server.py --socket /tmp/studymate-embed.sock
+    python src/embedding_server.py --socket /tmp/studymate-embed.sock --stats
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+QUERY = 0  # lower value = served first
+BULK = 1
+
+
+# ------------------- Wire protocol -------------------
+# Each message is a 4-byte big-endian length followed by a UTF-8 JSON body.
+
+def _send(sock, payload):
+    body = json.dumps(payload).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(body)) + body)
+
+
+def _recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        part = sock.recv(n - len(data))
+        if not part:
+            raise ConnectionError("Embedding server connection closed.")
+        data.extend(part)
+    return bytes(data)
+
+
+def _recv(sock):
+    (length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return json.loads(_recv_exact(sock, length).decode("utf-8"))
+
+
+# ------------------- Client -------------------
+
+class RemoteEmbeddings(Embeddings):
+    """
+    LangChain Embeddings backed by the shared embedding server.
+    Keeps one connection per thread; embed_query is sent as high priority.
+    """
+
+    def __init__(self, socket_path, model_name):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _request(self, payload):
+        # One retry on a fresh connection covers server restarts.
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send(sock, payload)
+                response = _recv(sock)
+                break
+            except (ConnectionError, OSError):
+                self._local.sock = None
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise RuntimeError(f"Embedding server error: {response.get('error')}")
+        return response
+
+    def info(self):
+        return self._request({"op": "info"})
+
+    def stats(self):
+        return self._request({"op": "stats"})["stats"]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._request({
+            "op": "embed", "kind": "bulk", "model": self.model_name, "texts": list(texts)
+        })["embeddings"]
+
+    def embed_query(self, text):
+        return self._request({
+            "op": "embed", "kind": "query", "model": self.model_name, "texts": [text]
+        })["embeddings"][0]
+
+
+def connect_remote_embeddings(socket_path, model_name):
+    """
+    Returns RemoteEmbeddings if a server for model_name is reachable at socket_path, else None.
+    """
+    try:
+        client = RemoteEmbeddings(socket_path, model_name)
+        served = client.info()["model"]
+    except (ConnectionError, OSError, RuntimeError) as e:
+        print(f"[WARN] Embedding server at '{socket_path}' unavailable ({e}); using in-process model.")
+        return None
+    if served != model_name:
+        print(f"[INFO] Embedding server serves '{served}', not '{model_name}'; using in-process model.")
+        return None
+    return client
+
+
+# ------------------- Server -------------------
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _Request:
+    def __init__(self, texts, priority):
+        self.texts = texts
+        self.priority = priority
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.embeddings = None
+        self.error = None
+
+
+class EmbeddingServer:
+    def __init__(self, model_name, socket_path, max_batch=64, max_wait_ms=5, window=10000):
+        self.model_name = model_name
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.engine = HuggingFaceEmbeddings(model_name=model_name)
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()  # FIFO within a priority level
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=window)
+        self._embed_times = deque(maxlen=window)
+        self._queue_latency = {QUERY: deque(maxlen=window), BULK: deque(maxlen=window)}
+        self._texts_total = 0
+        self._started = time.perf_counter()
+
+    def submit(self, texts, priority):
+        """
+        Queues texts and blocks until they are embedded.
+        Bulk requests are split into max_batch slices so queries can overtake them.
+        """
+        if not texts:
+            return []
+        step = self.max_batch if priority == BULK else len(texts)
+        requests = [_Request(texts[i:i + step], priority) for i in range(0, len(texts), step)]
+        for request in requests:
+            self._queue.put((priority, next(self._seq), request))
+        embeddings = []
+        for request in requests:
+            request.done.wait()
+            if request.error:
+                raise RuntimeError(request.error)
+            embeddings.extend(request.embeddings)
+        return embeddings
+
+    def _collect_batch(self, first):
+        deadline = time.perf_counter() + self.max_wait
+        batch = [first]
+        size = len(first.texts)
+        overflow = None
+
+        def take(item):
+            nonlocal size, overflow
+            request = item[2]
+            if size + len(request.texts) > self.max_batch:
+                overflow = item  # would push the batch past max_batch
+                return False
+            batch.append(request)
+            size += len(request.texts)
+            return True
+
+        # Whatever queued up while the model was busy joins this batch first.
+        while size < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not take(item):
+                break
+        # Then wait for stragglers, up to max_wait from when the batch was opened.
+        while overflow is None and size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            take(item)
+        if overflow is not None:
+            # Same (priority, seq) key, so it is next in line for the following batch.
+            self._queue.put(overflow)
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            _, _, first = self._queue.get()
+            batch = self._collect_batch(first)
+
+            started = time.perf_counter()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = self.engine.embed_documents(texts)
+            except Exception as e:
+                for request in batch:
+                    request.error = f"{type(e).__name__}: {e}"
+                    request.done.set()
+                continue
+            embed_time = time.perf_counter() - started
+
+            offset = 0
+            for request in batch:
+                request.embeddings = vectors[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+            with self._stats_lock:
+                self._batch_sizes.append(len(texts))
+                self._embed_times.append(embed_time)
+                self._texts_total += len(texts)
+                for request in batch:
+                    self._queue_latency[request.priority].append(started - request.enqueued)
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            latency = {kind: list(values) for kind, values in self._queue_latency.items()}
+            embed_times = list(self._embed_times)
+            texts_total = self._texts_total
+        elapsed = time.perf_counter() - self._started
+
+        def latency_summary(values):
+            return {
+                "count": len(values),
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p95_ms": _percentile(values, 95) * 1000,
+                "p99_ms": _percentile(values, 99) * 1000,
+            }
+
+        return {
+            "model": self.model_name,
+            "uptime_s": elapsed,
+            "texts_total": texts_total,
+            "batches": len(sizes),
+            "batch_size_mean": sum(sizes) / len(sizes) if sizes else 0.0,
+            "batch_size_p50": _percentile(sizes, 50),
+            "batch_size_max": max(sizes) if sizes else 0,
+            "embed_ms_p50": _percentile(embed_times, 50) * 1000,
+            "queue_depth": self._queue.qsize(),
+            "queue_latency_query": latency_summary(latency[QUERY]),
+            "queue_latency_bulk": latency_summary(latency[BULK]),
+        }
+
+    def _handle(self, message):
+        op = message.get("op")
+        if op == "info":
+            return {"ok": True, "model": self.model_name, "max_batch": self.max_batch}
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+        if op == "embed":
+            if message.get("model") != self.model_name:
+                return {"ok": False, "error": f"server model is '{self.model_name}'"}
+            priority = QUERY if message.get("kind") == "query" else BULK
+            return {"ok": True, "embeddings": self.submit(message["texts"], priority)}
+        return {"ok": False, "error": f"unknown op '{op}'"}
+
+    def _report_loop(self, every):
+        while True:
+            time.sleep(every)
+            s = self.stats()
+            print(f"[INFO] batches={s['batches']} mean_batch={s['batch_size_mean']:.1f} "
+                  f"max_batch={s['batch_size_max']} queue_depth={s['queue_depth']} "
+                  f"query_wait_p95={s['queue_latency_query']['p95_ms']:.1f}ms "
+                  f"bulk_wait_p95={s['queue_latency_bulk']['p95_ms']:.1f}ms")
+
+    def serve_forever(self, report_every=60):
+        server_ref = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        message = _recv(self.request)
+                    except (ConnectionError, OSError):
+                        return
+                    try:
+                        response = server_ref._handle(message)
+                    except Exception as e:
+                        response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                    _send(self.request, response)
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # stale socket from a previous run
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        if report_every:
+            threading.Thread(target=self._report_loop, args=(report_every,), daemon=True).start()
+
+        with socketserver.ThreadingUnixStreamServer(self.socket_path, Handler) as server:
+            server.daemon_threads = True
+            print(f"[INFO] Embedding server for '{self.model_name}' listening on {self.socket_path} "
+                  f"(max_batch={self.max_batch}, max_wait={self.max_wait * 1000:.0f}ms).")
+            try:
+                server.serve_forever()
+            finally:
+                os.remove(self.socket_path)
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Run the shared StudyMate embedding server.")
+    parser.add_argument("--socket", default=os.environ.get("EMBEDDING_SERVER_SOCKET", "/tmp/studymate-embed.sock"))
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL"))
+    parser.add_argument("--max-batch", type=int, default=64, help="Maximum texts per model call.")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Longest a request waits for a batch to fill.")
+    parser.add_argument("--report-every", type=float, default=60, help="Seconds between stats lines (0 = off).")
+    parser.add_argument("--stats", action="store_true", help="Print stats of a running server and exit.")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(json.dumps(RemoteEmbeddings(args.socket, args.model).stats(), indent=2))
+        return
+    server = EmbeddingServer(args.model, args.socket, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    server.serve_forever(report_every=args.report_every)
+
+
+if __name__ == "__main__":
+    main()
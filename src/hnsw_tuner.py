@@ -0,0 +1,170 @@
+"""
+Offline HNSW tuner for a session's collection.
+
+Loads the session's real vectors, holds out a sample as queries, computes
+exact top-k neighbours by brute force, then sweeps M / construction_ef /
+search_ef on hnswlib (the index library Chroma uses underneath) and reports
+recall@k against p95 single-query search latency and build time.
+
+The recommended setting is the fastest one that reaches --target-recall.
+With --pin, the session is rebuilt with it (vectors are copied, not
+re-embedded) and it is excluded from automatic re-tuning.
+
+Example:
+    python src/hnsw_tuner.py physics_101 --k 5 --target-recall 0.95
+    python src/hnsw_tuner.py physics_101 --pin            # pin the recommendation
+    python src/hnsw_tuner.py physics_101 --pin 16,100,64  # pin M,construction_ef,search_ef
+"""
+import argparse
+import os
+import time
+
+import hnswlib
+import numpy as np
+from langchain_chroma import Chroma
+
+from classes import Database, HNSW_SPACE, rebuild_collection, wait_for_retired_collections
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHROMA_DIR = os.path.join(PROJECT_ROOT, "chroma_db")
+DB_PATH = os.path.join(PROJECT_ROOT, "studymate.db")
+
+M_GRID = [8, 16, 32, 48]
+CONSTRUCTION_EF_GRID = [64, 100, 200, 400]
+SEARCH_EF_GRID = [16, 32, 64, 128, 256]
+
+
+def load_vectors(database, persist_dir, session_name, max_vectors=None, batch_size=5000):
+    collection_name, _ = database.get_session_collection(session_name)
+    collection = Chroma(collection_name=collection_name, persist_directory=persist_dir)._collection
+    space = (collection.metadata or {}).get("hnsw:space", HNSW_SPACE)
+    total = collection.count()
+    if max_vectors:
+        total = min(total, max_vectors)
+    vectors = []
+    offset = 0
+    while offset < total:
+        batch = collection.get(limit=min(batch_size, total - offset), offset=offset, include=["embeddings"])
+        if not batch["ids"]:
+            break
+        vectors.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    if not vectors:
+        raise ValueError(f"Session '{session_name}' has no vectors to tune on.")
+    return np.concatenate(vectors), space
+
+
+def exact_neighbours(base, queries, k, space):
+    # Brute force in query blocks to bound memory.
+    if space == "cosine":
+        base = base / np.linalg.norm(base, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    results = []
+    base_sq = (base ** 2).sum(axis=1)
+    for start in range(0, len(queries), 256):
+        block = queries[start:start + 256]
+        if space == "ip" or space == "cosine":
+            distances = -block @ base.T
+        else:
+            distances = base_sq[None, :] - 2 * block @ base.T
+        results.append(np.argsort(distances, axis=1)[:, :k])
+    return np.concatenate(results)
+
+
+def sweep(base, queries, truth, k, space):
+    rows = []
+    for m in M_GRID:
+        for construction_ef in CONSTRUCTION_EF_GRID:
+            index = hnswlib.Index(space=space, dim=base.shape[1])
+            started = time.perf_counter()
+            index.init_index(max_elements=len(base), M=m, ef_construction=construction_ef)
+            index.add_items(base, np.arange(len(base)))
+            build_s = time.perf_counter() - started
+            index.set_num_threads(1)  # per-query latency, like one request
+
+            for search_ef in SEARCH_EF_GRID:
+                index.set_ef(max(search_ef, k))
+                latencies = []
+                hits = 0
+                for query, expected in zip(queries, truth):
+                    started = time.perf_counter()
+                    labels, _ = index.knn_query(query, k=k)
+                    latencies.append(time.perf_counter() - started)
+                    hits += len(set(labels[0]) & set(expected))
+                rows.append({
+                    "M": m,
+                    "construction_ef": construction_ef,
+                    "search_ef": search_ef,
+                    "recall": hits / (len(queries) * k),
+                    "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+                    "build_s": build_s,
+                })
+    return rows
+
+
+def recommend(rows, target_recall):
+    good = [r for r in rows if r["recall"] >= target_recall]
+    if not good:
+        return max(rows, key=lambda r: (r["recall"], -r["p95_ms"]))
+    return min(good, key=lambda r: (r["p95_ms"], r["build_s"]))
+
+
+def print_rows(rows, k, best):
+    print(f"{'M':>4} {'c_ef':>5} {'s_ef':>5} {f'recall@{k}':>10} {'p95 ms':>8} {'build s':>8}")
+    for r in sorted(rows, key=lambda r: (r["M"], r["construction_ef"], r["search_ef"])):
+        marker = "  <- recommended" if r is best else ""
+        print(f"{r['M']:>4} {r['construction_ef']:>5} {r['search_ef']:>5} {r['recall']:>10.3f} "
+              f"{r['p95_ms']:>8.3f} {r['build_s']:>8.2f}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep HNSW settings on a session's vectors.")
+    parser.add_argument("session_name")
+    parser.add_argument("--k", type=int, default=5, help="Neighbours per query (RAGAssistant uses 5).")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out vectors used as queries.")
+    parser.add_argument("--max-vectors", type=int, default=None, help="Tune on at most this many vectors.")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--pin", nargs="?", const="recommended", default=None,
+                        help="Rebuild the session with the recommendation, or with M,construction_ef,search_ef.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path.")
+    parser.add_argument("--chroma", default=CHROMA_DIR, help="Chroma persistence directory.")
+    args = parser.parse_args()
+
+    database = Database(db_path=args.db)
+    vectors, space = load_vectors(database, args.chroma, args.session_name, args.max_vectors)
+
+    rng = np.random.default_rng(0)
+    n_queries = min(args.queries, max(1, len(vectors) // 10))
+    order = rng.permutation(len(vectors))
+    queries, base = vectors[order[:n_queries]], vectors[order[n_queries:]]
+    k = min(args.k, len(base))
+    print(f"[INFO] Tuning '{args.session_name}': {len(base)} vectors, {n_queries} queries, "
+          f"dim {vectors.shape[1]}, space {space}.")
+
+    truth = exact_neighbours(base, queries, k, space)
+    rows = sweep(base, queries, truth, k, space)
+    best = recommend(rows, args.target_recall)
+    print_rows(rows, k, best)
+
+    if args.pin:
+        if args.pin == "recommended":
+            m, construction_ef, search_ef = best["M"], best["construction_ef"], best["search_ef"]
+        else:
+            m, construction_ef, search_ef = (int(v) for v in args.pin.split(","))
+        new_name = rebuild_collection(database, args.chroma, args.session_name, {
+            "hnsw:space": space,
+            "hnsw:M": m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": search_ef,
+        }, pinned=True)
+        if new_name is None:
+            database.close()
+            raise SystemExit(1)
+        print(f"[INFO] Pinned '{args.session_name}' to M={m}, construction_ef={construction_ef}, search_ef={search_ef}.")
+        # The old collection is dropped after a grace period and needs the connection.
+        wait_for_retired_collections()
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
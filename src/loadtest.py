@@ -0,0 +1,388 @@
+"""
+Concurrent-user load test for the chat and ingestion paths.
+
+Simulated students run a weighted mix of operations against the real
+backend, with a stub LLM in place of Groq:
+
+    query        RAGAssistant.query (retrieval + streamed stub answer)
+    add_message  Database.add_message
+    add_file     vectordb.add_file (only when --pdf-dir is given)
+
+In thread mode every user shares one vectordb/RAGAssistant pair, like the
+app's st.cache_resource. With --processes > 1, each process builds its own
+backend (like separate Streamlit workers) and runs its share of the users on
+threads. Point EMBEDDING_SERVER_SOCKET at a shared embedding server to avoid
+loading one model per process.
+
+For each user count the run reports throughput, p50/p95/p99 latency per
+operation, query time-to-first-token, and error rates. Lock contention is
+reported twice: waits on the in-process Database lock (threads of one
+worker) and SQLite busy waits on the database file (other processes holding
+its write lock). Chroma's own persistence locks are not timed separately;
+they show up in the query and add_file latencies. Together the levels give
+a saturation curve.
+
+Run it against a scratch database, never the live one (the default
+--workdir is a fresh temporary directory).
+
+Example:
+    python src/loadtest.py --users 1,5,10,25,50 --duration 30 --pdf-dir ./sample_pdfs --csv curve.csv
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from classes import vectordb, RAGAssistant, wait_for_retired_collections
+
+QUESTIONS = [
+    "Summarise the main idea of the first chapter.",
+    "What is the definition given for momentum?",
+    "List the key formulas mentioned in the notes.",
+    "Explain the difference between the two methods described.",
+    "What examples are used to illustrate this concept?",
+]
+STUB_ANSWER = "This is a stubbed answer used for load testing. " * 4
+
+
+class StubRAGAssistant(RAGAssistant):
+    """RAGAssistant with a local fake chat model, so runs cost nothing and need no API key."""
+
+    def __init__(self, vector_database, token_delay=0.0):
+        self.token_delay = token_delay
+        super().__init__(vector_database)
+
+    def _initialize_llm(self):
+        # FakeListChatModel streams one character at a time, sleeping token_delay between them.
+        return FakeListChatModel(responses=[STUB_ANSWER], sleep=self.token_delay or None)
+
+
+class TimedLock:
+    """Wraps Database._lock and records how long each acquire waited."""
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._waits_lock = threading.Lock()
+        self.waits = []
+
+    def acquire(self, *args, **kwargs):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        waited = time.perf_counter() - started
+        with self._waits_lock:
+            self.waits.append(waited)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class BusyTimer:
+    """
+    Records SQLite busy waits on one connection. The connection's own busy
+    timeout is replaced by a retry loop with the same budget, so every wait
+    for another process's lock on the database file is timed.
+    """
+
+    def __init__(self, budget=10.0):
+        self.budget = budget
+        self._waits_lock = threading.Lock()
+        self.waits = []
+
+    def call(self, fn, *args, **kwargs):
+        started = None
+        delay = 0.001
+        try:
+            while True:
+                try:
+                    return fn(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    now = time.perf_counter()
+                    started = started or now
+                    if now - started >= self.budget:
+                        raise
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+        finally:
+            if started is not None:
+                with self._waits_lock:
+                    self.waits.append(time.perf_counter() - started)
+
+
+class _TimedCursor:
+    def __init__(self, cursor, timer):
+        self._cursor = cursor
+        self._timer = timer
+
+    def execute(self, *args):
+        self._timer.call(self._cursor.execute, *args)
+        return self
+
+    def executemany(self, *args):
+        self._timer.call(self._cursor.executemany, *args)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Wraps Database.conn so statements and commits go through a BusyTimer."""
+
+    def __init__(self, conn, timer):
+        conn.execute("PRAGMA busy_timeout = 0")
+        self._conn = conn
+        self._timer = timer
+
+    def execute(self, *args):
+        return self._timer.call(self._conn.execute, *args)
+
+    def commit(self):
+        self._timer.call(self._conn.commit)
+
+    def cursor(self):
+        return _TimedCursor(self._conn.cursor(), self._timer)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ------------------- Workload -------------------
+
+def build_backend(workdir, token_delay):
+    vdb = vectordb(
+        db_path=os.path.join(workdir, "loadtest.db"),
+        persist_dir=os.path.join(workdir, "chroma_db"),
+        upload_dir=os.path.join(workdir, "uploads")
+    )
+    timed_lock = TimedLock(vdb.database._lock)
+    vdb.database._lock = timed_lock
+    busy_timer = BusyTimer()
+    vdb.database.conn = TimedConnection(vdb.database.conn, busy_timer)
+    vdb.database.cursor = vdb.database.conn.cursor()
+    return vdb, StubRAGAssistant(vdb, token_delay=token_delay), (timed_lock, busy_timer)
+
+
+def seed(workdir, n_sessions, pdfs, token_delay):
+    vdb, _, _ = build_backend(workdir, token_delay)
+    names = [f"loadtest_{i}" for i in range(n_sessions)]
+    for name in names:
+        if vdb.create_session(name, "General") and pdfs:
+            vdb.add_file([pdfs[0]], name)
+    # Seeding can cross an HNSW tier; let the old collections drop before closing.
+    wait_for_retired_collections()
+    vdb.database.close()
+    return names
+
+
+def _user_loop(user_id, vdb, assistant, sessions, pdfs, mix, deadline, results, results_lock):
+    rng = random.Random(user_id)
+    ops = [op for op, weight in mix.items() if weight > 0 and (op != "add_file" or pdfs)]
+    weights = [mix[op] for op in ops]
+    session_name = sessions[user_id % len(sessions)]
+    session_id = vdb.database.get_session_id(session_name)
+    local = defaultdict(list)
+    errors = defaultdict(int)
+
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights)[0]
+        started = time.perf_counter()
+        try:
+            if op == "query":
+                first_token = None
+                for _ in assistant.query(session_name, rng.choice(QUESTIONS)):
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                local["query_ttft"].append(first_token or 0.0)
+            elif op == "add_message":
+                vdb.database.add_message(session_id, "user", rng.choice(QUESTIONS))
+            else:
+                vdb.add_file([rng.choice(pdfs)], session_name)
+            local[op].append(time.perf_counter() - started)
+        except Exception as e:
+            errors[op] += 1
+            errors[f"{op}:{type(e).__name__}"] += 1
+
+    with results_lock:
+        for op, values in local.items():
+            results["latency"][op].extend(values)
+        for key, count in errors.items():
+            results["errors"][key] += count
+
+
+def run_users(workdir, n_users, duration, sessions, pdfs, mix, token_delay, backend=None):
+    """Runs n_users threads against one backend. Returns raw latencies, errors and lock waits."""
+    if backend is None:
+        backend = build_backend(workdir, token_delay)
+    vdb, assistant, (timed_lock, busy_timer) = backend
+    timed_lock.waits.clear()
+    busy_timer.waits.clear()
+    results = {"latency": defaultdict(list), "errors": defaultdict(int)}
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=_user_loop,
+            args=(user_id, vdb, assistant, sessions, pdfs, mix, deadline, results, results_lock)
+        )
+        for user_id in range(n_users)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "latency": dict(results["latency"]),
+        "errors": dict(results["errors"]),
+        "lock_waits": list(timed_lock.waits),
+        "sqlite_waits": list(busy_timer.waits),
+    }
+
+
+def _process_entry(args):
+    workdir, offset, n_users, duration, sessions, pdfs, mix, token_delay = args
+    # Shift user ids so processes spread over different sessions.
+    sessions = sessions[offset % len(sessions):] + sessions[:offset % len(sessions)]
+    return run_users(workdir, n_users, duration, sessions, pdfs, mix, token_delay)
+
+
+def _merge(parts):
+    merged = {"latency": defaultdict(list), "errors": defaultdict(int), "lock_waits": [], "sqlite_waits": []}
+    for part in parts:
+        for op, values in part["latency"].items():
+            merged["latency"][op].extend(values)
+        for key, count in part["errors"].items():
+            merged["errors"][key] += count
+        merged["lock_waits"].extend(part["lock_waits"])
+        merged["sqlite_waits"].extend(part["sqlite_waits"])
+    return merged
+
+
+def summarise(n_users, duration, raw):
+    latency = raw["latency"]
+    row = {"users": n_users}
+    completed = sum(len(v) for op, v in latency.items() if op != "query_ttft")
+    failed = sum(count for key, count in raw["errors"].items() if ":" not in key)
+    row["ops_per_sec"] = completed / duration
+    row["error_rate"] = failed / (completed + failed) if completed + failed else 0.0
+    for op in ("query", "query_ttft", "add_message", "add_file"):
+        values = latency.get(op, [])
+        row[f"{op}_count"] = len(values)
+        for pct in (50, 95, 99):
+            row[f"{op}_p{pct}_ms"] = _percentile(values, pct) * 1000
+    waits = raw["lock_waits"]
+    row["lock_wait_total_s"] = sum(waits)
+    row["lock_wait_p95_ms"] = _percentile(waits, 95) * 1000
+    row["lock_wait_share"] = sum(waits) / (duration * n_users) if n_users else 0.0
+    busy = raw["sqlite_waits"]
+    row["sqlite_busy_count"] = len(busy)
+    row["sqlite_busy_total_s"] = sum(busy)
+    row["sqlite_busy_p95_ms"] = _percentile(busy, 95) * 1000
+    row["sqlite_busy_share"] = sum(busy) / (duration * n_users) if n_users else 0.0
+    row["errors"] = {key: count for key, count in raw["errors"].items() if ":" in key}
+    return row
+
+
+def print_curve(rows):
+    print("---- Saturation curve ----")
+    print(f"{'users':>5} {'ops/s':>8} {'q p50':>8} {'q p95':>8} {'q p99':>8} {'ttft p95':>9} "
+          f"{'msg p95':>8} {'file p95':>9} {'lock p95':>9} {'lock %':>7} {'busy p95':>9} {'busy %':>7} {'err %':>6}")
+    for r in rows:
+        print(f"{r['users']:>5} {r['ops_per_sec']:>8.1f} {r['query_p50_ms']:>8.0f} {r['query_p95_ms']:>8.0f} "
+              f"{r['query_p99_ms']:>8.0f} {r['query_ttft_p95_ms']:>9.0f} {r['add_message_p95_ms']:>8.1f} "
+              f"{r['add_file_p95_ms']:>9.0f} {r['lock_wait_p95_ms']:>9.2f} {r['lock_wait_share'] * 100:>6.1f}% "
+              f"{r['sqlite_busy_p95_ms']:>9.2f} {r['sqlite_busy_share'] * 100:>6.1f}% {r['error_rate'] * 100:>5.1f}%")
+        if r["errors"]:
+            print(f"      errors: {r['errors']}")
+    print("(latencies in ms; lock % = share of user time waiting on the in-process Database lock; "
+          "busy % = share waiting on SQLite's file lock held by another process)")
+
+
+def write_csv(rows, path):
+    fields = [k for k in rows[0] if k != "errors"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test StudyMate's chat and ingestion paths.")
+    parser.add_argument("--users", default="1,5,10,25,50", help="Comma-separated user counts to sweep.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level.")
+    parser.add_argument("--processes", type=int, default=1, help="Processes to spread users over.")
+    parser.add_argument("--sessions", type=int, default=5, help="Sessions the users are spread over.")
+    parser.add_argument("--pdf-dir", default=None, help="PDFs for seeding and the add_file operation.")
+    parser.add_argument("--mix", default="query=70,add_message=25,add_file=5",
+                        help="Operation weights, e.g. query=70,add_message=25,add_file=5.")
+    parser.add_argument("--token-delay-ms", type=float, default=0, help="Stub LLM delay per streamed character.")
+    parser.add_argument("--workdir", default=None, help="Scratch directory (default: a new temp dir).")
+    parser.add_argument("--csv", default=None, help="Write the saturation curve to this CSV file.")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="studymate-loadtest-")
+    mix = {op: float(w) for op, w in (item.split("=") for item in args.mix.split(","))}
+    pdfs = []
+    if args.pdf_dir:
+        pdfs = sorted(
+            os.path.abspath(os.path.join(args.pdf_dir, f))
+            for f in os.listdir(args.pdf_dir) if f.lower().endswith(".pdf")
+        )
+    token_delay = args.token_delay_ms / 1000
+    print(f"[INFO] Load test workdir: {workdir}")
+    sessions = seed(workdir, args.sessions, pdfs, token_delay)
+
+    rows = []
+    shared_backend = build_backend(workdir, token_delay) if args.processes == 1 else None
+    for n_users in [int(u) for u in args.users.split(",")]:
+        print(f"[INFO] Running {n_users} user(s) for {args.duration:.0f}s...")
+        if args.processes == 1:
+            raw = run_users(workdir, n_users, args.duration, sessions, pdfs, mix, token_delay,
+                            backend=shared_backend)
+        else:
+            n_procs = min(args.processes, n_users)
+            shares = [n_users // n_procs + (1 if i < n_users % n_procs else 0) for i in range(n_procs)]
+            tasks = [
+                (workdir, i, share, args.duration, sessions, pdfs, mix, token_delay)
+                for i, share in enumerate(shares)
+            ]
+            with multiprocessing.get_context("spawn").Pool(n_procs) as pool:
+                raw = _merge(pool.map(_process_entry, tasks))
+        rows.append(summarise(n_users, args.duration, raw))
+
+    print_curve(rows)
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"[INFO] Saturation curve written to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
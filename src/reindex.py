@@ -0,0 +1,231 @@
+"""
+Online re-indexing of a session with a different embedding model.
+
+The job builds a shadow Chroma collection from the page text stored in
+`document_pages` (PDFs are only parsed for documents ingested before page
+text was kept), embedding in batches while queries keep using the current
+collection. When every document is in the shadow collection, the session's
+row in `session_collections` is switched in a single UPDATE. After a short
+grace period, documents that still landed in the old collection (added just
+before the swap, or by an upload that opened it before the swap) are copied
+over from their page text, and the old collection is dropped. Near-duplicate chunks are
+skipped against the shadow collection's own index, which replaces the old
+collection's index at the swap.
+
+Example:
+    python src/reindex.py physics_101 --model sentence-transformers/all-mpnet-base-v2
+"""
+import argparse
+import os
+import threading
+import time
+import uuid
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from classes import vectordb, hnsw_params, load_pdf, page_rows, tag_chunks, versioned_collection_name
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHROMA_DIR = os.path.join(PROJECT_ROOT, "chroma_db")
+DB_PATH = os.path.join(PROJECT_ROOT, "studymate.db")
+
+
+class Reindexer:
+    def __init__(self, vector_database, session_name, model_name, batch_size=256, grace_seconds=5):
+        self.vector_db = vector_database
+        self.database = vector_database.database
+        self.session_name = session_name
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self.swap_attempts = 3
+        self.progress = {
+            "state": "idle",
+            "documents_done": 0,
+            "documents_total": 0,
+            "chunks": 0,
+            "chunks_per_sec": 0.0,
+            "elapsed": 0.0,
+            "error": None,
+        }
+        self._pending = []
+        self._started = None
+        self._thread = None
+
+    # ---------------- Public API ----------------
+    def start(self):
+        """Runs the job on a daemon thread; poll `progress` for status."""
+        self._thread = threading.Thread(target=self._run_safely, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def run(self):
+        session_id = self.database.get_session_id(self.session_name)
+        if session_id is None:
+            raise ValueError(f"Session '{self.session_name}' does not exist.")
+        old_name, old_model = self.vector_db.get_session_model(self.session_name)
+        # Keep pinned HNSW settings; otherwise size the shadow for what it will hold.
+        hnsw, pinned = self.database.get_session_hnsw(self.session_name)
+        if not pinned:
+            count = Chroma(collection_name=old_name, persist_directory=self.vector_db.persist_directory)._collection.count()
+            hnsw = hnsw_params(count)
+
+        shadow_name = versioned_collection_name(self.session_name, "v")
+        shadow = self.vector_db.open_collection(shadow_name, self.model_name, hnsw)
+        self.embedding_engine = self.vector_db.get_embedding_engine(self.model_name)
+
+        self.progress["state"] = "running"
+        self._started = time.perf_counter()
+        print(f"[INFO] Re-indexing '{self.session_name}': '{old_model}' -> '{self.model_name}' "
+              f"into '{shadow_name}'.")
+        done = set()
+        try:
+            self._catch_up(shadow, session_id, done)
+            # Atomic compare-and-swap: one UPDATE decides which collection queries open,
+            # and only if the session is still on the collection we enumerated.
+            for _ in range(self.swap_attempts):
+                if self.database.swap_session_collection(session_id, old_name, shadow_name, self.model_name,
+                                                         hnsw_params=hnsw, hnsw_pinned=pinned):
+                    break
+                current_name, current_model = self.vector_db.get_session_model(self.session_name)
+                if current_model != old_model:
+                    raise RuntimeError(f"'{self.session_name}' was re-indexed to '{current_model}' concurrently.")
+                # An HNSW rebuild moved the session (same model); follow it and catch up again.
+                print(f"[INFO] Re-index '{self.session_name}': collection moved '{old_name}' -> '{current_name}'.")
+                old_name = current_name
+                self._catch_up(shadow, session_id, done)
+            else:
+                raise RuntimeError(f"'{self.session_name}' kept moving to other collections; giving up.")
+        except Exception:
+            shadow.delete_collection()
+            self.database.clear_dedup_collection(shadow_name)
+            raise
+        self.progress["state"] = "swapped"
+        self._report()
+
+        # Give in-flight queries and uploads on the old collection a moment to finish.
+        time.sleep(self.grace_seconds)
+
+        # Final catch-up: uploads after the swap write to the shadow, so only
+        # documents with chunks (or dedup links) in the old collection are missing.
+        old = Chroma(collection_name=old_name, persist_directory=self.vector_db.persist_directory)
+        late = [
+            d for d in self.database.get_documents(session_id)
+            if d[0] not in done and self._in_collection(old, d[0])
+        ]
+        if late:
+            self.progress["documents_total"] = len(done) + len(late)
+            for doc_id, _, doc_name, file_path in late:
+                self._reindex_document(shadow, doc_id, doc_name, file_path)
+                done.add(doc_id)
+                self.progress["documents_done"] = len(done)
+            self._flush(shadow)
+            print(f"[INFO] Re-index '{self.session_name}': caught up {len(late)} document(s) added during the swap.")
+
+        old.delete_collection()
+        self.database.clear_dedup_collection(old_name)
+        self.progress["state"] = "done"
+        print(f"[INFO] Re-index of '{self.session_name}' complete; dropped '{old_name}'.")
+
+    # ---------------- Internals ----------------
+    def _catch_up(self, shadow, session_id, done):
+        # Loop until caught up, so documents added while we ran are included.
+        while True:
+            documents = [d for d in self.database.get_documents(session_id) if d[0] not in done]
+            if not documents:
+                break
+            self.progress["documents_total"] = len(done) + len(documents)
+            for doc_id, _, doc_name, file_path in documents:
+                self._reindex_document(shadow, doc_id, doc_name, file_path)
+                done.add(doc_id)
+                self.progress["documents_done"] = len(done)
+            self._flush(shadow)
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.progress["state"] = "failed"
+            self.progress["error"] = f"{type(e).__name__}: {e}"
+            print(f"[ERROR] Re-index of '{self.session_name}' failed: {e}")
+
+    def _in_collection(self, collection, doc_id):
+        if collection._collection.get(where={"doc_id": doc_id}, limit=1)["ids"]:
+            return True
+        return bool(self.database.get_linked_vectors(collection._collection.name, [doc_id]))
+
+    def _load_pages(self, doc_id, file_path):
+        pages = self.database.get_pages(doc_id)
+        if pages:
+            return pages
+        # Ingested before page text was stored: parse once and keep the text.
+        if not file_path or not os.path.exists(file_path):
+            raise FileNotFoundError(f"No stored page text and no file at '{file_path}' (doc_id {doc_id}).")
+        document, _, _ = load_pdf(file_path)
+        pages = page_rows(document)
+        self.database.add_pages(doc_id, pages)
+        return pages
+
+    def _reindex_document(self, shadow, doc_id, doc_name, file_path):
+        pages = [
+            Document(page_content=text or "", metadata={"source": file_path or doc_name, "page": page})
+            for page, text in self._load_pages(doc_id, file_path)
+        ]
+        for chunk in tag_chunks(self.vector_db.chunk_document(pages, self.model_name), doc_id):
+            self._pending.append(chunk)
+            if len(self._pending) >= self.batch_size:
+                self._flush(shadow)
+
+    def _flush(self, shadow):
+        if not self._pending:
+            return
+        collection_name = shadow._collection.name
+        ids = [str(uuid.uuid4()) for _ in self._pending]
+        dedup = self.vector_db.dedup
+        chunks, signatures, duplicates = self._pending, [], []
+        if dedup:
+            unique, signatures, duplicates = dedup.split(collection_name, chunks, ids)
+            chunks = [chunks[i] for i in unique]
+            ids = [ids[i] for i in unique]
+        if chunks:
+            texts = [chunk.page_content for chunk in chunks]
+            shadow._collection.add(
+                ids=ids,
+                embeddings=self.embedding_engine.embed_documents(texts),
+                documents=texts,
+                metadatas=[chunk.metadata for chunk in chunks]
+            )
+        if dedup:
+            dedup.register(collection_name, ids, signatures)
+            dedup.link(collection_name, duplicates)
+        self.progress["chunks"] += len(self._pending)
+        self._pending = []
+        self._report()
+
+    def _report(self):
+        elapsed = time.perf_counter() - self._started
+        self.progress["elapsed"] = elapsed
+        self.progress["chunks_per_sec"] = self.progress["chunks"] / elapsed if elapsed else 0.0
+        print(f"[INFO] Re-index '{self.session_name}': "
+              f"{self.progress['documents_done']}/{self.progress['documents_total']} documents, "
+              f"{self.progress['chunks']} chunks, {self.progress['chunks_per_sec']:.1f} chunks/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed a session with another model, then swap it in.")
+    parser.add_argument("session_name")
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL"),
+                        help="Target embedding model (default: EMBEDDING_MODEL).")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded per batch.")
+    parser.add_argument("--grace", type=float, default=5, help="Seconds to keep the old collection after the swap.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path.")
+    parser.add_argument("--chroma", default=CHROMA_DIR, help="Chroma persistence directory.")
+    args = parser.parse_args()
+
+    vdb = vectordb(db_path=args.db, persist_dir=args.chroma)
+    Reindexer(vdb, args.session_name, args.model, batch_size=args.batch_size, grace_seconds=args.grace).run()
+
+
+if __name__ == "__main__":
+    main()
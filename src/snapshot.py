@@ -0,0 +1,319 @@
+"""
+Portable session snapshots.
+
+A snapshot is a directory holding everything needed to recreate a session
+on another node without re-parsing or re-embedding its PDFs:
+
+    manifest.json     format version, embedding model, session row, counts
+    documents.jsonl   one documents row per line
+    messages.jsonl    one messages row per line
+    pages.jsonl       stored page text per document (for later re-indexing)
+    chunks.jsonl      chunk id, text and metadata, in embedding order
+    embeddings.npy    float32 [n_chunks, dim], memory-mappable
+    links.jsonl       skipped near-duplicate chunks and the vector standing in for each
+
+Export and import both work in fixed-size batches, so memory stays bounded
+regardless of the session size. The export covers the documents that existed
+when it started: chunks and links of documents added while it runs are left
+out, and import rejects any doc_id not listed in documents.jsonl.
+
+Example:
+    python src/snapshot.py export physics_101 /backups/physics_101
+    python src/snapshot.py import /backups/physics_101 --name physics_101_restored
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from langchain_chroma import Chroma
+
+from classes import Database, collection_metadata, hnsw_params
+from dedup import ChunkDeduplicator
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHROMA_DIR = os.path.join(PROJECT_ROOT, "chroma_db")
+DB_PATH = os.path.join(PROJECT_ROOT, "studymate.db")
+
+SNAPSHOT_FORMAT = 1
+BATCH_SIZE = 1000
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _map_doc_id(doc_id_map, doc_id):
+    if doc_id not in doc_id_map:
+        raise ValueError(f"Snapshot references doc_id {doc_id}, which is not in documents.jsonl.")
+    return doc_id_map[doc_id]
+
+
+def _copy_rows(path, rows, dim, batch_size):
+    # Shrinks an .npy file to its first `rows` rows, copying in batches.
+    source = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp"
+    target = open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(rows, dim))
+    for start in range(0, rows, batch_size):
+        end = min(start + batch_size, rows)
+        target[start:end] = source[start:end]
+    target.flush()
+    del target, source
+    os.replace(tmp_path, path)
+
+
+def export_session(database, persist_dir, session_name, out_dir, batch_size=BATCH_SIZE):
+    """
+    Writes a snapshot of session_name into out_dir (created if missing).
+    Returns the manifest dict.
+    """
+    session = database.get_session(session_name)
+    if session is None:
+        raise ValueError(f"Session '{session_name}' does not exist.")
+    session_id, _, subject_category, created_at = session
+    os.makedirs(out_dir, exist_ok=True)
+
+    documents = database.get_documents(session_id)
+    _write_jsonl(os.path.join(out_dir, "documents.jsonl"), (
+        {"doc_id": doc_id, "doc_name": doc_name, "file_path": file_path}
+        for doc_id, _, doc_name, file_path in documents
+    ))
+    with open(os.path.join(out_dir, "pages.jsonl"), "w", encoding="utf-8") as pages_file:
+        for doc_id, _, _, _ in documents:
+            for page, text in database.get_pages(doc_id):
+                pages_file.write(json.dumps(
+                    {"doc_id": doc_id, "page": page, "text": text},
+                    ensure_ascii=False
+                ) + "\n")
+    n_messages = 0
+    with open(os.path.join(out_dir, "messages.jsonl"), "w", encoding="utf-8") as messages_file:
+        for _, _, sender, content, timestamp in database.iter_messages(session_id, batch_size):
+            messages_file.write(json.dumps(
+                {"sender": sender, "content": content, "timestamp": timestamp},
+                ensure_ascii=False
+            ) + "\n")
+            n_messages += 1
+
+    collection_name, embedding_model = database.get_session_collection(session_name)
+    hnsw, hnsw_pinned = database.get_session_hnsw(session_name)
+    collection = Chroma(collection_name=collection_name, persist_directory=persist_dir)._collection
+    # Rows and documents are fixed here; anything added while exporting is left out.
+    total = collection.count()
+    exported_docs = {doc_id for doc_id, _, _, _ in documents}
+    exported_ids = set()
+    embeddings = None
+    embeddings_path = os.path.join(out_dir, "embeddings.npy")
+    dim = 0
+    offset = written = 0
+    with open(os.path.join(out_dir, "chunks.jsonl"), "w", encoding="utf-8") as chunks_file:
+        while offset < total:
+            batch = collection.get(
+                limit=min(batch_size, total - offset),
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"]
+            )
+            if not batch["ids"]:
+                break
+            offset += len(batch["ids"])
+            # Untagged chunks predate doc_id metadata and always belong to the session.
+            keep = [
+                i for i, metadata in enumerate(batch["metadatas"])
+                if not metadata or "doc_id" not in metadata or metadata["doc_id"] in exported_docs
+            ]
+            if not keep:
+                continue
+            if embeddings is None:
+                dim = len(batch["embeddings"][0])
+                embeddings = open_memmap(embeddings_path, mode="w+", dtype=np.float32, shape=(total, dim))
+            n = len(keep)
+            embeddings[written:written + n] = np.asarray([batch["embeddings"][i] for i in keep], dtype=np.float32)
+            for i in keep:
+                chunks_file.write(json.dumps(
+                    {"id": batch["ids"][i], "text": batch["documents"][i], "metadata": batch["metadatas"][i] or {}},
+                    ensure_ascii=False
+                ) + "\n")
+                exported_ids.add(batch["ids"][i])
+            written += n
+
+    if embeddings is None:
+        # Empty session: still write a valid (0, 0) array so import is uniform.
+        np.save(embeddings_path, np.zeros((0, 0), dtype=np.float32))
+    else:
+        embeddings.flush()
+        del embeddings
+        if written < total:
+            _copy_rows(embeddings_path, written, dim, batch_size)
+    _write_jsonl(os.path.join(out_dir, "links.jsonl"), (
+        {"vector_id": vector_id, "doc_id": doc_id, "page": page, "text_bytes": text_bytes}
+        for vector_id, doc_id, page, text_bytes in database.iter_chunk_links(collection_name, batch_size)
+        if doc_id in exported_docs and vector_id in exported_ids
+    ))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        # Legacy sessions have no recorded model; they were built with EMBEDDING_MODEL.
+        "embedding_model": embedding_model or os.environ.get("EMBEDDING_MODEL"),
+        "session_name": session_name,
+        "subject_category": subject_category,
+        "created_at": created_at,
+        "exported_at": datetime.now().isoformat(),
+        "documents": len(documents),
+        "messages": n_messages,
+        "chunks": written,
+        "dim": dim,
+        "hnsw_params": hnsw,
+        "hnsw_pinned": hnsw_pinned,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[INFO] Exported '{session_name}': {len(documents)} documents, "
+          f"{n_messages} messages, {written} chunks.")
+    return manifest
+
+
+def import_session(database, persist_dir, snapshot_dir, session_name=None, batch_size=BATCH_SIZE):
+    """
+    Recreates a session from a snapshot directory.
+    Raises ValueError if the snapshot was built with a different embedding model
+    than EMBEDDING_MODEL, or if the target session name already exists.
+    Returns the new session_id.
+    """
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+
+    current_model = os.environ.get("EMBEDDING_MODEL")
+    if manifest["embedding_model"] != current_model:
+        raise ValueError(
+            f"Snapshot was embedded with '{manifest['embedding_model']}', "
+            f"but EMBEDDING_MODEL is '{current_model}'."
+        )
+
+    session_name = session_name or manifest["session_name"]
+    session_id = database.restore_session(session_name, manifest["subject_category"], manifest["created_at"])
+    if session_id is None:
+        raise ValueError(f"Session '{session_name}' already exists.")
+
+    # Pinned settings travel with the snapshot; otherwise size the index for what it will hold.
+    hnsw_pinned = bool(manifest.get("hnsw_pinned"))
+    hnsw = manifest.get("hnsw_params") if hnsw_pinned else hnsw_params(manifest["chunks"])
+    chroma = Chroma(collection_name=session_name, persist_directory=persist_dir)
+    try:
+        # A collection can outlive its sessions row; never append to a stale one.
+        chroma.delete_collection()
+        chroma = Chroma(
+            collection_name=session_name,
+            persist_directory=persist_dir,
+            collection_metadata=collection_metadata(manifest["embedding_model"], hnsw)
+        )
+        database.set_session_collection(session_id, session_name, manifest["embedding_model"],
+                                        hnsw_params=hnsw, hnsw_pinned=hnsw_pinned)
+
+        documents = list(_read_jsonl(os.path.join(snapshot_dir, "documents.jsonl")))
+        new_doc_ids = database.restore_documents(session_id, [(d["doc_name"], d["file_path"]) for d in documents])
+        doc_id_map = {d["doc_id"]: new_id for d, new_id in zip(documents, new_doc_ids)}
+
+        pages_path = os.path.join(snapshot_dir, "pages.jsonl")
+        if os.path.exists(pages_path):
+            for batch in _batched(_read_jsonl(pages_path), batch_size):
+                by_doc = {}
+                for p in batch:
+                    by_doc.setdefault(_map_doc_id(doc_id_map, p["doc_id"]), []).append((p["page"], p["text"]))
+                for doc_id, rows in by_doc.items():
+                    database.add_pages(doc_id, rows)
+        for batch in _batched(_read_jsonl(os.path.join(snapshot_dir, "messages.jsonl")), batch_size):
+            database.add_messages_bulk(session_id, [(m["sender"], m["content"], m["timestamp"]) for m in batch])
+
+        # Signatures are cheap to recompute, so they are rebuilt rather than shipped.
+        dedup = ChunkDeduplicator(database)
+        embeddings = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r")
+        offset = 0
+        for batch in _batched(_read_jsonl(os.path.join(snapshot_dir, "chunks.jsonl")), batch_size):
+            n = len(batch)
+            for c in batch:
+                # doc_ids are reassigned on import; keep chunk scoping pointing at the right rows.
+                if c["metadata"] and "doc_id" in c["metadata"]:
+                    c["metadata"]["doc_id"] = _map_doc_id(doc_id_map, c["metadata"]["doc_id"])
+            chroma._collection.add(
+                ids=[c["id"] for c in batch],
+                embeddings=embeddings[offset:offset + n].tolist(),
+                documents=[c["text"] for c in batch],
+                metadatas=[c["metadata"] or None for c in batch]
+            )
+            dedup.register(session_name, [c["id"] for c in batch], [dedup.signature(c["text"] or "") for c in batch])
+            offset += n
+
+        links_path = os.path.join(snapshot_dir, "links.jsonl")
+        if os.path.exists(links_path):
+            for batch in _batched(_read_jsonl(links_path), batch_size):
+                database.add_chunk_links(session_name, [
+                    (l["vector_id"], _map_doc_id(doc_id_map, l["doc_id"]), l["page"], l["text_bytes"])
+                    for l in batch
+                ])
+    except Exception:
+        # Leave no half-imported session behind.
+        try:
+            chroma.delete_collection()
+        except Exception:
+            pass
+        database.delete_session(session_name)
+        raise
+
+    print(f"[INFO] Imported '{session_name}': {len(documents)} documents, "
+          f"{manifest['messages']} messages, {offset} chunks.")
+    return session_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import StudyMate session snapshots.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path.")
+    parser.add_argument("--chroma", default=CHROMA_DIR, help="Chroma persistence directory.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = sub.add_parser("export", help="Write a session snapshot.")
+    export_cmd.add_argument("session_name")
+    export_cmd.add_argument("out_dir")
+
+    import_cmd = sub.add_parser("import", help="Restore a session from a snapshot.")
+    import_cmd.add_argument("snapshot_dir")
+    import_cmd.add_argument("--name", default=None, help="Session name to restore as (default: original).")
+
+    args = parser.parse_args()
+    database = Database(db_path=args.db)
+    try:
+        if args.command == "export":
+            export_session(database, args.chroma, args.session_name, args.out_dir)
+        else:
+            import_session(database, args.chroma, args.snapshot_dir, session_name=args.name)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        raise SystemExit(1)
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    main()